@@ -3,9 +3,16 @@ from model import *
 from collections import deque
 import random
 import torch
-import torch.nn as nn
 import torch.optim as optim
-from plot import plot
+from selfplay import VecSelfPlay
+from search import *
+from book import BookBuilder, OpeningBook
+from endgame import load_tables
+from checkpoint import CheckpointWriter, load_latest, CHECKPOINT_HYPERPARAMS
+from inference import export
+import os
+import re
+import sys
 
 
 AGENT_HYPERPARAMS = {
@@ -13,7 +20,18 @@ AGENT_HYPERPARAMS = {
     'lr': 0.5,
     'lambda': 0.7,
     'gamma': 0.99,
-    'loss': nn.MSELoss()
+    'update_every': 8,              # plies of accumulated td updates per optimizer step
+    'workers': SEARCH_HYPERPARAMS['workers'],
+    'persistent_search': True,      # keep the transposition table and history between moves of a game
+}
+
+TRAIN_HYPERPARAMS = {
+    'draw_score': 0.05,         # |evaluation| below this counts towards a draw adjudication
+    'draw_plies': 40,           # consecutive searched plies near zero before declaring a draw
+    'resign_score': 0.95,       # |evaluation| above this counts towards a resignation
+    'resign_plies': 6,          # consecutive searched plies past the threshold before resigning
+    'book': './models/book.bin',
+    'match_sprt': (0, 10),      # elo bounds for the early-stopping test against the last model
 }
 
 
@@ -24,32 +42,100 @@ class Agent:
         self.epsilon = 0.75
         self.gamma = AGENT_HYPERPARAMS['gamma']
         self.lamda = AGENT_HYPERPARAMS['lambda']
-        self.loss = AGENT_HYPERPARAMS['loss']
-        self.optimizer = optim.AdamW(self.model.parameters(), lr=AGENT_HYPERPARAMS['lr'])
+        self.optimizer = self._make_optimizer()
+        self.pending = 0
+        self.tt = None
+        self.move_rng = None
+        self.book = None
+        self.inference = None
+        self.nodes = 0
+        self.leaf_evaluations = 0
+        self.stop = None
+        self.smp_pool = None
+        self.history = [[0] * 4096 for _ in range(2)]
+        self.expected = None
+
+    def _make_optimizer(self):
+        # one fused kernel for the whole update where torch supports it on this device,
+        # otherwise the multi-tensor foreach implementation.
+        try:
+            return optim.AdamW(self.model.parameters(), lr=AGENT_HYPERPARAMS['lr'], fused=True)
+        except (RuntimeError, TypeError, ValueError):
+            return optim.AdamW(self.model.parameters(), lr=AGENT_HYPERPARAMS['lr'], foreach=True)
 
     def _q_search(self, board):
         # todo
         pass
 
+    def _ordered_moves(self, board, side, tt_code):
+        legals = board.legal_moves(side)
+        if self.move_rng is not None:
+            legals = legals.copy()
+            self.move_rng.shuffle(legals)
+        # quiet moves that caused cutoffs elsewhere in the tree are tried first.
+        history = self.history[side]
+        legals = sorted(legals, key=lambda move: -history[MoveUtils.encode(move) & 4095])
+        if tt_code is not None:
+            tt_move = MoveUtils.decode(board, tt_code)
+            if tt_move is not None:
+                legals = [tt_move] + [move for move in legals if move != tt_move]
+        return legals
+
+    def _record_cutoff(self, board, side, move, depth):
+        if board.cells[move.cell.row][move.cell.col] is None:
+            self.history[side][MoveUtils.encode(move) & 4095] += depth * depth
+
     def _minimax_search_alpha_beta(self, board, depth, alpha, beta):
-        # todo: add move ordering
+        self.nodes += 1
+        if self.stop is not None and self.stop.is_set():
+            raise SearchAborted
         side = board.side_to_move
         if depth == 0:
+            entry = None
+            if self.tt is not None:
+                entry = self.tt.probe(board.hash)
+                if entry is not None and entry[1] == EXACT:
+                    return None, entry[2]
+            self.leaf_evaluations += 1
+            evaluator = self.model if self.inference is None else self.inference
             with torch.no_grad():
-                return None, self.model(board.get_state(side)).item() * (1 - 2*side)
+                score = evaluator(board.get_state(side)).item() * (1 - 2*side)
+            # a deeper bound for the same position is worth more than a static evaluation.
+            if self.tt is not None and entry is None:
+                self.tt.store(board.hash, 0, EXACT, score, 0)
+            return None, score
+
+        # the stored flag is judged against the window we were called with, not the one the
+        # table entry narrows it to.
+        alpha_orig, beta_orig = alpha, beta
+        tt_code = None
+        if self.tt is not None:
+            entry = self.tt.probe(board.hash)
+            if entry is not None:
+                tt_depth, flag, tt_score, tt_code = entry
+                if tt_depth >= depth:
+                    if flag == LOWER:
+                        alpha = max(alpha, tt_score)
+                    elif flag == UPPER:
+                        beta = min(beta, tt_score)
+                    if flag == EXACT or beta <= alpha:
+                        tt_move = MoveUtils.decode(board, tt_code)
+                        if tt_move is not None:
+                            return tt_move, tt_score
 
         if side == 0:
             # white to move, wants to maximize evaluation.
             best_score = -2.0
             best_move = None
-            legals = board.legal_moves(side)
+            legals = self._ordered_moves(board, side, tt_code)
             for move in legals:
                 next_board, reward, done = board.apply_move(move)
                 if done:
                     if reward == 1:
-                        return move, 1.0
+                        best_move, best_score = move, 1.0
+                        break
                     else:
-                        score = 0.0
+                        score = float(reward)
                 else:
                     score = self._minimax_search_alpha_beta(next_board, depth-1, alpha, beta)[1]
                 if score > best_score:
@@ -57,21 +143,22 @@ class Agent:
                     best_move = move
                 alpha = max(alpha, score)
                 if beta <= alpha:
+                    self._record_cutoff(board, side, move, depth)
                     break
-            return best_move, best_score
 
         else:
             # black to move, wants to minimize evaluation.
             best_score = 2.0
             best_move = None
-            legals = board.legal_moves(side)
+            legals = self._ordered_moves(board, side, tt_code)
             for move in legals:
                 next_board, reward, done = board.apply_move(move)
                 if done:
                     if reward == 1:
-                        return move, -1.0
+                        best_move, best_score = move, -1.0
+                        break
                     else:
-                        score = 0.0
+                        score = -float(reward)
                 else:
                     score = self._minimax_search_alpha_beta(next_board, depth-1, alpha, beta)[1]
                 if score < best_score:
@@ -79,62 +166,211 @@ class Agent:
                     best_move = move
                 beta = min(beta, score)
                 if beta <= alpha:
+                    self._record_cutoff(board, side, move, depth)
                     break
-            return best_move, best_score
+
+        if self.tt is not None and best_move is not None:
+            if best_score <= alpha_orig:
+                flag = UPPER
+            elif best_score >= beta_orig:
+                flag = LOWER
+            else:
+                flag = EXACT
+            self.tt.store(board.hash, depth, flag, best_score, MoveUtils.encode(best_move))
+        return best_move, best_score
+
+    def new_game(self):
+        # search state is carried from one move to the next within a game, never across games.
+        if self.tt is None and AGENT_HYPERPARAMS['persistent_search']:
+            self.tt = TranspositionTable(shared=AGENT_HYPERPARAMS['workers'] > 1)
+        elif self.tt is not None:
+            self.tt.clear()
+        self.history = [[0] * 4096 for _ in range(2)]
+        self.expected = None
+
+    def new_search(self, board):
+        # ages the state left by the previous search and returns the first depth still worth
+        # searching: the previous search already explored board if the game followed its
+        # principal variation.
+        if self.tt is not None:
+            self.tt.new_search()
+        self.history = [[value >> 1 for value in table] for table in self.history]
+        if self.tt is not None and self.expected is not None and self.expected[0] == board.hash:
+            return self.expected[1] + 1
+        return 1
+
+    def expect(self, board, depth):
+        # remembers where the game goes if both sides follow the principal variation, with
+        # the depth the finished search explored it to.
+        self.expected = None
+        pv = principal_variation(self, board, 2)
+        if len(pv) == 2 and depth > 2:
+            after, _, done = board.apply_move(pv[0])
+            if not done:
+                after, _, _ = after.apply_move(pv[1])
+                self.expected = (after.hash, depth - 2)
 
     def get_action(self, board, greedy=True):
+        if self.book is not None:
+            move = self.book.sample(board)
+            if move is not None:
+                return move, None
         if greedy and random.random() < self.epsilon:
             move = random.choice(board.legal_moves(board.side_to_move))
             return move, None
+        elif AGENT_HYPERPARAMS['workers'] > 1:
+            self.new_search(board)
+            best_move, evaluation, _ = lazy_smp_search(self, board, AGENT_HYPERPARAMS['depth'], AGENT_HYPERPARAMS['workers'],
+                                                       self.tt)
+            return best_move, evaluation
+        elif self.tt is not None:
+            return iterative_deepening(self, board, AGENT_HYPERPARAMS['depth'])
         else:
             best_move, evaluation = self._minimax_search_alpha_beta(board, AGENT_HYPERPARAMS['depth'], -2.0, 2.0)
             return best_move, evaluation
 
     def train(self, states, rewards, next_states, eligibilities, done, losses):
+        # td(lambda) on the latest ply. eligibilities holds one trace per player of the game,
+        # a decaying sum of the value gradients of that player's earlier states. the td error
+        # of this ply times the trace is added into the gradients, and the optimizer steps
+        # once every update_every plies or at the end of a game.
+        params = list(self.model.parameters())
+        value = self.model(states[-1])
+        gradients = torch.autograd.grad(value.sum(), params)
         with torch.no_grad():
             if done:
-                td_pred = rewards[-1] - self.model(states[-1])
+                td_error = (rewards[-1] - value).item()
             else:
-                td_pred = rewards[-1] + self.gamma * self.model(next_states[-1]) - self.model(states[-1])
+                td_error = (rewards[-1] + self.gamma * self.model(next_states[-1]) - value).item()
 
-        if states[-1] in eligibilities:
-            eligibilities[states[-1]] += 1
-        else:
-            eligibilities[states[-1]] = 1
-
-        for idx in range(len(states)):
-            pred = self.model(states[idx])
-            self.optimizer.zero_grad()
-            loss = self.loss(td_pred, pred)
-            if idx == len(states) - 1:
-                losses.append(loss.detach().item())
-            loss.backward()
+            player = (len(states) - 1) % 2
+            if player not in eligibilities:
+                eligibilities[player] = [torch.zeros_like(param) for param in params]
+            trace = eligibilities[player]
+            torch._foreach_mul_(trace, self.gamma * self.lamda)
+            torch._foreach_add_(trace, list(gradients))
+
+            if params[0].grad is None:
+                for param in params:
+                    param.grad = torch.zeros_like(param)
+            # the optimizer minimizes, so ascending td_error * trace means adding its negative.
+            torch._foreach_add_([param.grad for param in params], trace, alpha=-td_error)
+        losses.append(td_error ** 2)
+
+        self.pending += 1
+        if self.pending >= AGENT_HYPERPARAMS['update_every'] or done:
             self.optimizer.step()
-            eligibilities[states[-1]] = self.gamma*self.lamda*eligibilities[states[-1]]
+            self.optimizer.zero_grad(set_to_none=False)
+            self.pending = 0
 
-    def analyze_performance(self):
-        # todo: figure out
-        pass
+    @staticmethod
+    def adjudicate(score, mover, counters):
+        # score is the white-perspective search evaluation of the move just played by mover.
+        # returns (reward, done) from the mover's point of view, like Board.apply_move.
+        if score is None:
+            return 0, False
+        counters['draw'] = counters['draw'] + 1 if abs(score) < TRAIN_HYPERPARAMS['draw_score'] else 0
+        counters['resign'] = counters['resign'] + 1 if abs(score) > TRAIN_HYPERPARAMS['resign_score'] else 0
+        if counters['draw'] >= TRAIN_HYPERPARAMS['draw_plies']:
+            return 0, True
+        if counters['resign'] >= TRAIN_HYPERPARAMS['resign_plies']:
+            mover_score = score * (1 - 2*mover)
+            return (1 if mover_score > 0 else -1), True
+        return 0, False
+
+    def freeze(self, backend='fp32', validate=True):
+        # search-only agents evaluate leaves with a fused export of the model. training keeps
+        # changing self.model, so a frozen agent must not be trained.
+        self.inference = None if backend is None else export(self.model, backend, validate=validate)
+
+    def load_book(self, path=TRAIN_HYPERPARAMS['book']):
+        if self.book is not None:
+            self.book.close()
+            self.book = None
+        if os.path.exists(path):
+            self.book = OpeningBook(path)
+
+    def restore(self, state):
+        # loads a checkpoint written by CheckpointWriter and returns the recorded losses.
+        self.model.load_state_dict(state['model'])
+        # the saved param groups carry their own fused/foreach flags, keep the ones chosen here.
+        flags = [{key: group.get(key) for key in ['fused', 'foreach']} for group in self.optimizer.param_groups]
+        self.optimizer.load_state_dict(state['optimizer'])
+        for group, saved in zip(self.optimizer.param_groups, flags):
+            group.update(saved)
+        self.episodes = state['episodes']
+        self.epsilon = state['epsilon']
+        return state['losses']
+
+
+def analyze_performance(state, index, folder=CHECKPOINT_HYPERPARAMS['folder']):
+    # plays the weights of a checkpoint snapshot against the newest saved model and writes the
+    # report next to it. runs on the checkpoint thread, before the snapshot itself is saved.
+    # returns None while there is nothing to compare against, or when the newest model already
+    # holds these weights, as it does right after a resume.
+    from match import run_match
+    previous = []
+    if os.path.exists(folder):
+        for file_name in os.listdir(folder):
+            match = re.fullmatch(r'model(\d+)\.pth', file_name)
+            if match:
+                previous.append((int(match.group(1)), os.path.join(folder, file_name)))
+    if len(previous) == 0:
+        return None
+    previous_index, previous = max(previous)
+    if previous_index >= index:
+        return None
+    saved = torch.load(previous, map_location='cpu')
+    if all(torch.equal(saved[key], value) for key, value in state['model'].items()):
+        return None
+    report = run_match(state['model'], previous, sprt=TRAIN_HYPERPARAMS['match_sprt'],
+                       report_path=os.path.join(folder, f'match{state["episodes"]}.json'))
+    print(f'>> episode {state["episodes"]}: score {report["score"]:.3f}, elo {report["elo"]:+.0f} against {previous}')
+    return report
+
+
+def _winner(reward, mover):
+    if reward == 1:
+        return mover
+    elif reward == -1:
+        return 1 - mover
+    return None
 
 
-def train():
+def train(resume=False):
+    from plot import plot
 
     agent = Agent()
+    agent.load_book()
+    Board.endgames = load_tables()
+    book = BookBuilder()
+    if resume and os.path.exists(TRAIN_HYPERPARAMS['book']):
+        # the book is rewritten from the builder, which must start from what is already there.
+        book.merge_file(TRAIN_HYPERPARAMS['book'])
     losses = deque(maxlen=100)
+    state = load_latest() if resume else None
+    if state is not None:
+        losses.extend(agent.restore(state))
+    checkpoints = CheckpointWriter(analyze=analyze_performance)
 
     while True:
 
         if agent.episodes % 100 == 0:
-            agent.analyze_performance()
-            agent.model.save(f'model{int(agent.episodes/100)}.pth')
+            checkpoints.submit(agent, losses, int(agent.episodes/100))
+            if len(book.entries) > 0:
+                book.write(TRAIN_HYPERPARAMS['book'])
+                agent.load_book()
 
         board = Board()
+        agent.new_game()
         agent.episodes += 1
 
         states = []
         rewards = []
         next_states = []
         eligibilities = {}
+        adjudication = {'draw': 0, 'resign': 0}
+        plies = []
 
         while True:
 
@@ -143,18 +379,55 @@ def train():
 
             states.append(board.get_state(board.side_to_move))
             action, score = agent.get_action(board)
+            mover = board.side_to_move
+            plies.append((board.hash, MoveUtils.encode(action), mover))
             board, reward, done = board.apply_move(action)
+            if not done:
+                reward, done = agent.adjudicate(score, mover, adjudication)
             next_states.append(board.get_state(1 - board.side_to_move))
             rewards.append(reward)
 
             agent.train(states, rewards, next_states, eligibilities, done, losses)
 
             if done:
+                book.add_game(plies, _winner(reward, mover))
                 plot(losses, agent.episodes)
                 agent.episodes += 1
                 agent.epsilon = 0.75 / int(1 + agent.episodes/200)
                 break
                 
 
+def train_vectorized(resume=False):
+    from plot import plot
+
+    agent = Agent()
+    agent.load_book()
+    Board.endgames = load_tables()
+    book = BookBuilder()
+    if resume and os.path.exists(TRAIN_HYPERPARAMS['book']):
+        # the book is rewritten from the builder, which must start from what is already there.
+        book.merge_file(TRAIN_HYPERPARAMS['book'])
+    losses = deque(maxlen=100)
+    state = load_latest() if resume else None
+    if state is not None:
+        losses.extend(agent.restore(state))
+    checkpoints = CheckpointWriter(analyze=analyze_performance)
+    # the batched games search with VecSelfPlay's own trees, never with the agent's tt or
+    # history, and they are interleaved, so there is no per-game search state to reset here.
+    env = VecSelfPlay(agent)
+
+    while True:
+        for trajectory in env.step(losses):
+            if agent.episodes % 100 == 0:
+                checkpoints.submit(agent, losses, int(agent.episodes/100))
+                if len(book.entries) > 0:
+                    book.write(TRAIN_HYPERPARAMS['book'])
+                    agent.load_book()
+            book.add_game(trajectory['plies'], trajectory['winner'])
+            agent.episodes += 1
+            plot(losses, agent.episodes)
+            agent.epsilon = 0.75 / int(1 + agent.episodes/200)
+
+
 if __name__ == '__main__':
-    train()
+    train(resume='--resume' in sys.argv)
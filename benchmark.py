@@ -0,0 +1,220 @@
+import argparse
+import time
+
+
+BENCH_FEN = 'r1bqkb1r/pppp1ppp/2n2n2/4p3/2B1P3/5N2/PPPP1PPP/RNBQK2R w KQkq - 4 4'
+
+# imported in a fresh interpreter by the startup benchmark, one process per measurement.
+STARTUP_PROBE = '''
+import resource, sys, time
+start = time.perf_counter()
+import {module}
+elapsed = time.perf_counter() - start
+heavy = [name for name in ('torch', 'numpy', 'matplotlib') if name in sys.modules]
+print(elapsed, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss, ','.join(heavy) or '-')
+'''
+
+# reported by the self-play benchmark, with True where a larger value is better.
+SELFPLAY_METRICS = {
+    'games_per_hour': True,
+    'plies_per_s': True,
+    'nodes_per_s': True,
+    'leaf_evaluations_per_s': True,
+    'optimizer_steps_per_s': True,
+    'peak_rss_mb': False,
+}
+
+
+def bench_smp(args):
+    from agent import Agent
+    from chess import Board
+    from search import lazy_smp_search
+
+    agent = Agent()
+    board = Board(args.fen)
+    baseline = None
+    for workers in args.workers:
+        # the first search also starts the pool, the second is what every later move costs.
+        start = time.perf_counter()
+        lazy_smp_search(agent, board, args.depth, workers)
+        first = time.perf_counter() - start
+        start = time.perf_counter()
+        move, score, depth = lazy_smp_search(agent, board, args.depth, workers)
+        elapsed = time.perf_counter() - start
+        baseline = baseline or elapsed
+        print(f'{workers} workers:\tdepth {depth} in {elapsed:.2f}s\tspeedup x{baseline/elapsed:.2f}\tscore {score:.4f}'
+              f'\tfirst search {first:.2f}s')
+    agent.smp_pool.close()
+
+
+def bench_inference(args):
+    import torch
+    from model import DNN
+    from inference import export, max_error, sample_states, INFERENCE_TOLERANCE
+
+    model = DNN()
+    states = sample_states(args.positions)
+    batch = states.repeat(args.batch // len(states) + 1, 1)[:args.batch]
+    candidates = [('DNN', model, None)] + [(backend, export(model, backend, states), backend) for backend in args.backends]
+    for name, evaluator, backend in candidates:
+        with torch.no_grad():
+            start = time.perf_counter()
+            for idx in range(args.repeat):
+                evaluator(states[idx % len(states)]).item()
+            latency = (time.perf_counter() - start) / args.repeat
+            start = time.perf_counter()
+            for _ in range(args.repeat // 10 + 1):
+                evaluator(batch)
+            throughput = len(batch) * (args.repeat // 10 + 1) / (time.perf_counter() - start)
+        error = '' if backend is None else f'\tmax error {max_error(model, evaluator, states):.2e} (tolerance {INFERENCE_TOLERANCE[backend]:.0e})'
+        print(f'{name}:\t{latency * 1e6:.1f} us/position\t{throughput:.0f} positions/s batched{error}')
+
+
+def bench_startup(args):
+    import os
+    import statistics
+    import subprocess
+    import sys
+
+    folder = os.path.dirname(os.path.abspath(__file__))
+    for module in args.modules:
+        imports, totals, rss, heavy = [], [], 0, '-'
+        for _ in range(args.repeat):
+            start = time.perf_counter()
+            result = subprocess.run([sys.executable, '-c', STARTUP_PROBE.format(module=module)], cwd=folder,
+                                    capture_output=True, text=True)
+            totals.append(time.perf_counter() - start)
+            if result.returncode != 0:
+                break
+            elapsed, peak, heavy = result.stdout.split()
+            imports.append(float(elapsed))
+            rss = max(rss, int(peak))
+        if result.returncode != 0:
+            print(f'{module}:\tfailed to import ({result.stderr.strip().splitlines()[-1]})')
+            continue
+        # ru_maxrss is in kilobytes on linux.
+        print(f'{module}:\t{statistics.median(imports) * 1000:.0f} ms import\t{statistics.median(totals) * 1000:.0f} ms '
+              f'process\t{rss / 1024:.0f} MB peak RSS\tloads {heavy}')
+
+
+def bench_selfplay(args):
+    import json
+    import platform
+    import random
+    import resource
+    import torch
+    from collections import deque
+    from agent import Agent, AGENT_HYPERPARAMS
+    from chess import Board
+
+    # the training loop of agent.train without book, endgame tables, display or checkpoints,
+    # on a single search worker so that a seed always plays the same games.
+    random.seed(args.seed)
+    torch.manual_seed(args.seed)
+    AGENT_HYPERPARAMS['depth'] = args.depth
+    AGENT_HYPERPARAMS['workers'] = 1
+    agent = Agent()
+    agent.epsilon = args.epsilon
+    steps = [0]
+    agent.optimizer.register_step_post_hook(lambda *_: steps.__setitem__(0, steps[0] + 1))
+    losses = deque(maxlen=100)
+
+    games, plies = 0, 0
+    start = time.perf_counter()
+    while plies < args.plies:
+        board = Board()
+        agent.new_game()
+        states, rewards, next_states, eligibilities = [], [], [], {}
+        adjudication = {'draw': 0, 'resign': 0}
+        for game_ply in range(args.max_game_plies):
+            states.append(board.get_state(board.side_to_move))
+            action, score = agent.get_action(board)
+            mover = board.side_to_move
+            board, reward, done = board.apply_move(action)
+            if not done:
+                reward, done = agent.adjudicate(score, mover, adjudication)
+            next_states.append(board.get_state(1 - board.side_to_move))
+            rewards.append(reward)
+            agent.train(states, rewards, next_states, eligibilities, done, losses)
+            plies += 1
+            if done or plies == args.plies:
+                break
+        if done or game_ply == args.max_game_plies - 1:
+            games += 1
+    elapsed = time.perf_counter() - start
+
+    report = {
+        'config': {'seed': args.seed, 'plies': args.plies, 'depth': args.depth, 'epsilon': args.epsilon,
+                   'max_game_plies': args.max_game_plies, 'python': platform.python_version(),
+                   'torch': torch.__version__, 'threads': torch.get_num_threads()},
+        'elapsed': elapsed,
+        'games': games,
+        'plies': plies,
+        'games_per_hour': games * 3600 / elapsed,
+        'plies_per_s': plies / elapsed,
+        'nodes_per_s': agent.nodes / elapsed,
+        'leaf_evaluations_per_s': agent.leaf_evaluations / elapsed,
+        'optimizer_steps_per_s': steps[0] / elapsed,
+        # ru_maxrss is in kilobytes on linux.
+        'peak_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        'move_cache_hit_rate': None if Board.move_cache is None else Board.move_cache.hit_rate(),
+    }
+
+    baseline = None
+    if args.baseline is not None:
+        with open(args.baseline) as file:
+            baseline = json.load(file)
+        if baseline['config'] != report['config']:
+            print(f'warning: baseline was measured with {baseline["config"]}')
+    print(f'{games} games, {plies} plies in {elapsed:.1f}s, move cache hit rate {report["move_cache_hit_rate"] or 0:.1%}')
+    for metric, higher in SELFPLAY_METRICS.items():
+        line = f'{metric}:\t{report[metric]:.2f}'
+        if baseline is not None:
+            change = report[metric] / baseline[metric] - 1 if baseline[metric] else 0.0
+            verdict = 'better' if (change > 0) == higher else 'worse'
+            line += f'\tbaseline {baseline[metric]:.2f}\t{change:+.1%} {verdict if change else ""}'
+        print(line)
+    if args.output is not None:
+        with open(args.output, 'w') as file:
+            json.dump(report, file, indent=2)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='deep-carlsen benchmarks')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    smp = commands.add_parser('smp', help='lazy SMP time-to-depth')
+    smp.add_argument('--fen', default=BENCH_FEN)
+    smp.add_argument('--depth', type=int, default=3)
+    smp.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4, 8])
+    smp.set_defaults(run=bench_smp)
+
+    inference = commands.add_parser('inference', help='DNN against its frozen inference exports')
+    inference.add_argument('--positions', type=int, default=64)
+    inference.add_argument('--batch', type=int, default=1024)
+    inference.add_argument('--repeat', type=int, default=2000)
+    inference.add_argument('--backends', nargs='+', default=['fp32', 'int8', 'numpy'])
+    inference.set_defaults(run=bench_inference)
+
+    startup = commands.add_parser('startup', help='import time and memory of every entry point')
+    startup.add_argument('--modules', nargs='+',
+                         default=['chess', 'search', 'book', 'endgame', 'agent', 'match', 'uci', 'dataset', 'ingest'])
+    startup.add_argument('--repeat', type=int, default=5)
+    startup.set_defaults(run=bench_startup)
+
+    selfplay = commands.add_parser('selfplay', help='end-to-end self-play and training throughput')
+    selfplay.add_argument('--plies', type=int, default=400)
+    selfplay.add_argument('--depth', type=int, default=2)
+    selfplay.add_argument('--epsilon', type=float, default=0.1)
+    selfplay.add_argument('--max-game-plies', type=int, default=200)
+    selfplay.add_argument('--seed', type=int, default=0)
+    selfplay.add_argument('--output', help='write the report as JSON')
+    selfplay.add_argument('--baseline', help='a JSON report to compare against')
+    selfplay.set_defaults(run=bench_selfplay)
+
+    args = parser.parse_args()
+    args.run(args)
+
+
+if __name__ == '__main__':
+    main()
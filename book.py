@@ -0,0 +1,140 @@
+from chess import *
+import argparse
+import mmap
+import os
+import random
+import struct
+
+
+BOOK_HYPERPARAMS = {
+    'plies': 16,            # only the first plies of every game go into the book
+    'min_visits': 3,        # moves seen fewer times than this are never played from the book
+    'play_rate': 0.75,      # chance of playing from the book in a book position, otherwise exploration and search decide
+}
+
+HEADER = struct.Struct('<4sIQ')         # magic, version, record count
+RECORD = struct.Struct('<QHIf')         # position hash, move code, visits, average result for the mover
+MAGIC = b'DCBK'
+VERSION = 1
+
+
+class BookBuilder:
+    # accumulates (position hash, move) -> visits and summed result from finished games.
+
+    def __init__(self):
+        self.entries = {}
+
+    def add(self, key, move_code, visits, result_sum):
+        moves = self.entries.setdefault(key, {})
+        if move_code in moves:
+            moves[move_code][0] += visits
+            moves[move_code][1] += result_sum
+        else:
+            moves[move_code] = [visits, result_sum]
+
+    def add_game(self, plies, winner):
+        # plies are (position hash, move code, mover) in game order. winner is the color
+        # that won the game or None for a draw.
+        for key, move_code, mover in plies[:BOOK_HYPERPARAMS['plies']]:
+            if winner is None:
+                result = 0.0
+            else:
+                result = 1.0 if mover == winner else -1.0
+            self.add(key, move_code, 1, result)
+
+    def merge_file(self, path):
+        for key, move_code, visits, average in OpeningBook(path).records():
+            self.add(key, move_code, visits, average * visits)
+
+    def write(self, path):
+        # written to a temporary file first so readers never map a half-written book.
+        records = sorted((key, move_code, visits, result_sum / visits)
+                         for key, moves in self.entries.items()
+                         for move_code, (visits, result_sum) in moves.items())
+        temp_path = path + '.tmp'
+        with open(temp_path, 'wb') as file:
+            file.write(HEADER.pack(MAGIC, VERSION, len(records)))
+            for record in records:
+                file.write(RECORD.pack(*record))
+        os.replace(temp_path, path)
+
+
+class OpeningBook:
+    # read-only view of a book file. the records are sorted by position hash, so a position is
+    # found with a binary search over the memory-mapped file without loading it.
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as file:
+            self.map = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, self.count = HEADER.unpack_from(self.map, 0)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError(f'{path} is not a version {VERSION} opening book')
+
+    def _record(self, idx):
+        return RECORD.unpack_from(self.map, HEADER.size + idx * RECORD.size)
+
+    def records(self):
+        for idx in range(self.count):
+            yield self._record(idx)
+
+    def lookup(self, key):
+        # all (move code, visits, average result) entries stored for the position hash.
+        low, high = 0, self.count
+        while low < high:
+            mid = (low + high) // 2
+            if self._record(mid)[0] < key:
+                low = mid + 1
+            else:
+                high = mid
+        entries = []
+        while low < self.count:
+            record = self._record(low)
+            if record[0] != key:
+                break
+            entries.append(record[1:])
+            low += 1
+        return entries
+
+    def sample(self, board, min_visits=BOOK_HYPERPARAMS['min_visits'], play_rate=BOOK_HYPERPARAMS['play_rate']):
+        # picks a book move with probability proportional to the points it scored, visits times
+        # the expected score (1 + average) / 2 of the mover, so a move that only ever lost is
+        # never played. None if the position is not in the book, or is left to the caller.
+        if random.random() >= play_rate:
+            return None
+        moves = []
+        weights = []
+        for move_code, visits, average in self.lookup(board.hash):
+            if visits < min_visits or average <= -1.0:
+                continue
+            move = MoveUtils.decode(board, move_code)
+            if move is not None:
+                moves.append(move)
+                weights.append(visits * (1 + average) / 2)
+        if len(moves) == 0:
+            return None
+        return random.choices(moves, weights)[0]
+
+    def close(self):
+        self.map.close()
+
+
+def merge(output, inputs):
+    builder = BookBuilder()
+    for path in inputs:
+        builder.merge_file(path)
+    builder.write(output)
+    return len(builder.entries)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='merge opening books written by several self-play workers')
+    parser.add_argument('output')
+    parser.add_argument('inputs', nargs='+')
+    args = parser.parse_args()
+    positions = merge(args.output, args.inputs)
+    print(f'{positions} positions written to {args.output}')
+
+
+if __name__ == '__main__':
+    main()
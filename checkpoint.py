@@ -0,0 +1,99 @@
+import atexit
+import copy
+import os
+import queue
+import re
+import threading
+import torch
+
+
+CHECKPOINT_HYPERPARAMS = {
+    'folder': './models',
+    'keep': 5,      # full checkpoints kept on disk, older ones are deleted
+}
+
+
+class CheckpointWriter:
+    # writes checkpoints on a background thread. the training loop only pays for copying the
+    # state into a snapshot; serialization and disk I/O happen while self-play continues.
+    # analyze(snapshot, index, folder) is called on the same thread before each snapshot is
+    # saved, so a slow evaluation match never holds up self-play or overlaps a write.
+
+    def __init__(self, folder=CHECKPOINT_HYPERPARAMS['folder'], keep=CHECKPOINT_HYPERPARAMS['keep'], analyze=None):
+        self.folder = folder
+        self.keep = keep
+        self.analyze = analyze
+        self.closing = False
+        if not os.path.exists(folder):
+            os.makedirs(folder)
+        self.queue = queue.Queue()
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+        atexit.register(self.close)
+
+    @staticmethod
+    def snapshot(agent, losses):
+        return {
+            'model': {key: value.detach().clone() for key, value in agent.model.state_dict().items()},
+            'optimizer': copy.deepcopy(agent.optimizer.state_dict()),
+            'episodes': agent.episodes,
+            'epsilon': agent.epsilon,
+            'losses': list(losses),
+        }
+
+    def submit(self, agent, losses, index):
+        self.queue.put((index, self.snapshot(agent, losses)))
+
+    def _save(self, obj, file_name):
+        # write to a temporary file and rename it, a crash never leaves a truncated checkpoint.
+        path = os.path.join(self.folder, file_name)
+        temp_path = path + '.tmp'
+        torch.save(obj, temp_path)
+        os.replace(temp_path, path)
+
+    def _run(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                self.queue.task_done()
+                break
+            index, state = item
+            if self.analyze is not None and not self.closing:
+                try:
+                    self.analyze(state, index, self.folder)
+                except Exception as error:
+                    print(f'>> checkpoint {index}: analysis failed, {error!r}')
+            self._save(state['model'], f'model{index}.pth')
+            self._save(state, f'checkpoint{index}.pt')
+            for old in list_checkpoints(self.folder)[:-self.keep]:
+                os.remove(old)
+            self.queue.task_done()
+
+    def close(self):
+        # flushes pending checkpoints. also runs at interpreter exit, so an interrupted run
+        # still finishes the write it had started.
+        # pending analyses are skipped, only the writes are waited for.
+        if self.thread.is_alive():
+            self.closing = True
+            self.queue.put(None)
+            self.thread.join()
+
+
+def list_checkpoints(folder=CHECKPOINT_HYPERPARAMS['folder']):
+    # full checkpoints in the folder, oldest first.
+    if not os.path.exists(folder):
+        return []
+    found = []
+    for file_name in os.listdir(folder):
+        match = re.fullmatch(r'checkpoint(\d+)\.pt', file_name)
+        if match:
+            found.append((int(match.group(1)), os.path.join(folder, file_name)))
+    return [path for _, path in sorted(found)]
+
+
+def load_latest(folder=CHECKPOINT_HYPERPARAMS['folder']):
+    # the weights are memory-mapped rather than read, so resuming does not wait on the whole file.
+    checkpoints = list_checkpoints(folder)
+    if len(checkpoints) == 0:
+        return None
+    return torch.load(checkpoints[-1], map_location='cpu', mmap=True, weights_only=False)
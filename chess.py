@@ -1,14 +1,32 @@
 from collections import namedtuple
 import copy
-import torch
-import numpy as np
+import random
+import struct
+import sys
 
 
 Move = namedtuple('Move', 'piece, cell, special')
 Cell = namedtuple('Cell', 'row, col')
 
 
+_zobrist_rng = random.Random(20240601)
+ZOBRIST = {
+    'pieces': {
+        color: {
+            piece_type: [[_zobrist_rng.getrandbits(64) for _ in range(8)] for _ in range(8)]
+            for piece_type in ['k', 'q', 'r', 'n', 'b', 'p']
+        }
+        for color in range(2)
+    },
+    'side': _zobrist_rng.getrandbits(64),
+    'castling': [[_zobrist_rng.getrandbits(64) for _ in range(2)] for _ in range(2)],
+    'enpassant': [_zobrist_rng.getrandbits(64) for _ in range(8)],
+}
+
+
 class CellUtils:
+    squares = [Cell(square // 8, square % 8) for square in range(64)]
+
     @staticmethod
     def cell(cell):
         if type(cell) == Cell:
@@ -24,6 +42,148 @@ class CellUtils:
             return cell
 
 
+class MoveUtils:
+    promotions = [None, 'q', 'r', 'b', 'n', 'c']
+
+    @staticmethod
+    def encode(move):
+        # packs a move into 15 bits: from square, to square and special flag.
+        start = move.piece.row * 8 + move.piece.col
+        end = move.cell.row * 8 + move.cell.col
+        return start | (end << 6) | (MoveUtils.promotions.index(move.special) << 12)
+
+    @staticmethod
+    def decode(board, code):
+        # finds the legal move of board matching code, None if it is not legal there.
+        start, end, special = code & 63, (code >> 6) & 63, MoveUtils.promotions[(code >> 12) & 7]
+        board._ensure_moves()
+        piece = board.cells[start // 8][start % 8]
+        if piece is None or piece.color != board.side_to_move:
+            return None
+        for move in piece.legal:
+            if move.cell.row * 8 + move.cell.col == end and move.special == special:
+                return move
+        return None
+
+    @staticmethod
+    def to_uci(move):
+        code = CellUtils.cell_code(Cell(move.piece.row, move.piece.col)) + CellUtils.cell_code(move.cell)
+        if move.special is not None and move.special != 'c':
+            code += move.special
+        return code
+
+    @staticmethod
+    def castling(board, c_side):
+        # the castling move of the side to move, built directly as the king's castling moves are
+        # not part of its legal list. None unless the right is still held, the rook is home, the
+        # squares between them are empty and the king does not start, cross or land in check.
+        side = board.side_to_move
+        king = board.pieces[side]['k'][0]
+        row = 7 if side == 0 else 0
+        rook = board.cells[row][7 if c_side == 0 else 0]
+        between, crossed = ([5, 6], [4, 5, 6]) if c_side == 0 else ([1, 2, 3], [2, 3, 4])
+        if board.castling[side][c_side] != 1 or king.row != row or king.col != 4:
+            return None
+        if rook is None or rook.color != side or rook.notation.lower() != 'r':
+            return None
+        if any(board.cells[row][col] is not None for col in between):
+            return None
+        board._ensure_moves()
+        for enemy in board.material[1 - side]:
+            if any(Cell(row, col) in enemy.attacks for col in crossed):
+                return None
+        return Move(king, Cell(row, 6 if c_side == 0 else 2), 'c')
+
+    @staticmethod
+    def from_uci(board, text):
+        # long algebraic notation as used by UCI, castling is written as the king's move.
+        # returns None for a move the board does not generate.
+        start, end = CellUtils.cell(text[0:2]), CellUtils.cell(text[2:4])
+        promotion = text[4] if len(text) > 4 else None
+        king = board.pieces[board.side_to_move]['k'][0]
+        if king.row == start.row == end.row and king.col == start.col == 4 and end.col in [2, 6]:
+            return MoveUtils.castling(board, 0 if end.col == 6 else 1)
+        for move in board.legal_moves(board.side_to_move):
+            if move.piece.row == start.row and move.piece.col == start.col and move.cell == end:
+                if move.special == promotion or (promotion is None and move.special == 'c'):
+                    return move
+        return None
+
+    @staticmethod
+    def from_san(board, san):
+        # standard algebraic notation as found in PGN files.
+        san = san.rstrip('+#!?')
+        side = board.side_to_move
+        if san in ['O-O', 'O-O-O', '0-0', '0-0-0']:
+            return MoveUtils.castling(board, 0 if len(san) == 3 else 1)
+        promotion = None
+        if '=' in san:
+            san, promotion = san.split('=')
+            promotion = promotion.lower()
+        elif san[-1] in 'QRBN' and san[0].islower():
+            san, promotion = san[:-1], san[-1].lower()
+        piece_type = san[0].lower() if san[0] in 'KQRBN' else 'p'
+        body = san[1:] if piece_type != 'p' else san
+        body = body.replace('x', '')
+        end, hint = CellUtils.cell(body[-2:]), body[:-2]
+        candidates = []
+        for move in board.legal_moves(side):
+            if move.piece.notation.lower() != piece_type or move.cell != end or move.special != promotion:
+                continue
+            start = CellUtils.cell_code(Cell(move.piece.row, move.piece.col))
+            if all(char in start for char in hint):
+                candidates.append(move)
+        return candidates[0] if len(candidates) == 1 else None
+
+
+class MoveCache:
+    # maps a position hash to its attacks, legal moves, attack maps and check status packed
+    # into a few hundred bytes, so a position reached again through a transposition or in
+    # another game is restored instead of regenerated. nothing more is stored once the
+    # entries hold max_bytes.
+
+    def __init__(self, size=1 << 16, max_bytes=64 << 20):
+        self.size = 1 << (size.bit_length() - 1)
+        self.mask = self.size - 1
+        self.max_bytes = max_bytes
+        self.entries = [None] * self.size
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def _footprint(key, value):
+        return sys.getsizeof(key) + sys.getsizeof(value) + sys.getsizeof((key, value))
+
+    def probe(self, key):
+        entry = self.entries[key & self.mask]
+        if entry is not None and entry[0] == key:
+            self.hits += 1
+            return entry[1]
+        self.misses += 1
+        return None
+
+    def store(self, key, value):
+        idx = key & self.mask
+        old = self.entries[idx]
+        freed = 0 if old is None else self._footprint(*old)
+        used = self._footprint(key, value)
+        if self.bytes - freed + used > self.max_bytes:
+            return
+        self.entries[idx] = (key, value)
+        self.bytes += used - freed
+
+    def hit_rate(self):
+        total = self.hits + self.misses
+        return self.hits / total if total > 0 else 0.0
+
+    def clear(self):
+        self.entries = [None] * self.size
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+
+
 class Piece:
     def __init__(self, color, cell, notation, value):
         self.color = color
@@ -384,7 +544,25 @@ class Pawn(Piece):
 
 
 class Board:
-    def __init__(self, fen: str = 'rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1'):
+    move_cache = MoveCache()     # None regenerates every position
+    endgames = None     # endgame.EndgameTables, adjudicates covered positions in apply_move when set
+    packed_size = 102
+    piece_codes = ' KQRBNP  kqrbnp'
+    # the piece list slots read by the features, per color: (piece type, slots).
+    feature_slots = [('k', 1), ('q', 1), ('r', 2), ('n', 2), ('b', 2), ('p', 8)]
+
+    def __init__(self, fen: str = 'rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1', lazy=False):
+        self._reset()
+        piece_position, side, castling, enpassant_target, half_moves, full_moves = fen.split(' ')
+        self._read_cells(piece_position)
+        self._read_side_to_play(side)
+        self._read_castling(castling)
+        self._read_enpassant(enpassant_target)
+        self.half_moves = int(half_moves)
+        self.full_moves = int(full_moves)
+        self._finish_setup(lazy)
+
+    def _reset(self):
         self.pieces = {
             0: {'k': [], 'q': [], 'r': [], 'n': [], 'b': [], 'p': []},
             1: {'k': [], 'q': [], 'r': [], 'n': [], 'b': [], 'p': []},
@@ -402,14 +580,98 @@ class Board:
         self.castling = [[0, 0], [0, 0]]    # (short, long) castle
         self.enpassant = None
         self.lowest_attackers = None
-        piece_position, side, castling, enpassant_target, half_moves, full_moves = fen.split(' ')
-        self._read_cells(piece_position)
-        self._read_side_to_play(side)
-        self._read_castling(castling)
-        self._read_enpassant(enpassant_target)
-        self.half_moves = int(half_moves)
+
+    def _finish_setup(self, lazy):
+        self.hash = self._compute_hash()
+        self.repetitions = {self.hash: 1}    # position hash -> count since the last irreversible move
+        self.stale = True                    # attacks, legal moves and attack maps not yet computed
+        if not lazy:
+            self._ensure_moves()
+
+    def _ensure_moves(self):
+        if self.stale:
+            self._refresh_moves()
+
+    def _refresh_moves(self):
+        # brings attacks, legal moves and attack maps up to date, from the move cache when the
+        # position was generated before. returns (check, checkmate) for the side to move.
+        self.stale = False
+        packed = None if Board.move_cache is None else Board.move_cache.probe(self.hash)
+        if packed is not None:
+            return self._unpack_moves(packed)
         self._update_moves()
         self._update_attack_maps()
+        check = self.is_check(self.side_to_move)
+        checkmate = check and self.is_checkmate(self.side_to_move)
+        if Board.move_cache is not None:
+            Board.move_cache.store(self.hash, self._pack_moves(check, checkmate))
+        return check, checkmate
+
+    def _pack_moves(self, check, checkmate):
+        # per live piece: its square, attack and legal move counts, the attacked squares and
+        # (target, special) pairs. then both attack maps and the check flags.
+        data = bytearray()
+        for color in range(2):
+            for piece in self.material[color]:
+                data += bytes((piece.row * 8 + piece.col, len(piece.attacks), len(piece.legal)))
+                data += bytes(cell.row * 8 + cell.col for cell in piece.attacks)
+                for move in piece.legal:
+                    data += bytes((move.cell.row * 8 + move.cell.col, MoveUtils.promotions.index(move.special)))
+        for color in range(2):
+            for row in self.lowest_attackers[color]:
+                data += bytes(row)
+        data.append(check | (checkmate << 1))
+        return bytes(data)
+
+    def _unpack_moves(self, data):
+        squares = CellUtils.squares
+        offset = 0
+        for _ in range(len(self.material[0]) + len(self.material[1])):
+            square, attacks, legals = data[offset], data[offset + 1], data[offset + 2]
+            piece = self.cells[square >> 3][square & 7]
+            offset += 3
+            piece.attacks = [squares[target] for target in data[offset:offset + attacks]]
+            offset += attacks
+            piece.legal = [Move(piece, squares[data[idx]], MoveUtils.promotions[data[idx + 1]])
+                           for idx in range(offset, offset + 2 * legals, 2)]
+            offset += 2 * legals
+            piece.mobility = legals
+        self.lowest_attackers = {
+            color: [list(data[offset + color * 64 + row * 8:offset + color * 64 + row * 8 + 8]) for row in range(8)]
+            for color in range(2)
+        }
+        flags = data[offset + 128]
+        return bool(flags & 1), bool(flags & 2)
+
+    def _new_piece(self, char, r, c, listed=True):
+        piece = self._make_piece(char, r, c)
+        self.pieces[piece.color][char.lower()].append(piece)
+        if listed:
+            self.pieces_for_piece_list[piece.color][char.lower()].append(piece)
+        self.material[piece.color].append(piece)
+        return piece
+
+    @staticmethod
+    def _make_piece(char, r, c):
+        piece = None
+        if char.isupper():
+            color = 0
+        else:
+            color = 1
+        match char.lower():
+            case 'k':
+                piece = King(color, Cell(r, c))
+            case 'q':
+                piece = Queen(color, Cell(r, c))
+            case 'r':
+                piece = Rook(color, Cell(r, c))
+            case 'n':
+                piece = Knight(color, Cell(r, c))
+            case 'b':
+                piece = Bishop(color, Cell(r, c))
+            case 'p':
+                piece = Pawn(color, Cell(r, c))
+        return piece
 
     def _read_cells(self, piece_position):
         rows = piece_position.split('/')
@@ -420,39 +682,7 @@ class Board:
                 if char.isdigit():
                     board_row.extend([None] * int(char))
                 else:
-                    c = len(board_row)
-                    piece = None
-                    if char.isupper():
-                        color = 0
-                    else:
-                        color = 1
-                    match char.lower():
-                        case 'k':
-                            piece = King(color, Cell(r, c))
-                            self.pieces[color]['k'].append(piece)
-                            self.pieces_for_piece_list[color]['k'].append(piece)
-                        case 'q':
-                            piece = Queen(color, Cell(r, c))
-                            self.pieces[color]['q'].append(piece)
-                            self.pieces_for_piece_list[color]['q'].append(piece)
-                        case 'r':
-                            piece = Rook(color, Cell(r, c))
-                            self.pieces[color]['r'].append(piece)
-                            self.pieces_for_piece_list[color]['r'].append(piece)
-                        case 'n':
-                            piece = Knight(color, Cell(r, c))
-                            self.pieces[color]['n'].append(piece)
-                            self.pieces_for_piece_list[color]['n'].append(piece)
-                        case 'b':
-                            piece = Bishop(color, Cell(r, c))
-                            self.pieces[color]['b'].append(piece)
-                            self.pieces_for_piece_list[color]['b'].append(piece)
-                        case 'p':
-                            piece = Pawn(color, Cell(r, c))
-                            self.pieces[color]['p'].append(piece)
-                            self.pieces_for_piece_list[color]['p'].append(piece)
-                    self.material[color].append(piece)
-                    board_row.append(piece)
+                    board_row.append(self._new_piece(char, r, len(board_row)))
             self.cells.append(board_row)
 
     def _read_side_to_play(self, side):
@@ -475,6 +705,27 @@ class Board:
         if enpassant_target != '-':
             self.enpassant = CellUtils.cell(enpassant_target)
 
+    def _compute_hash(self):
+        h = 0
+        for color in range(2):
+            for piece in self.material[color]:
+                h ^= ZOBRIST['pieces'][color][piece.notation.lower()][piece.row][piece.col]
+            for c_side in range(2):
+                if self.castling[color][c_side] == 1:
+                    h ^= ZOBRIST['castling'][color][c_side]
+        if self.side_to_move == 1:
+            h ^= ZOBRIST['side']
+        if self.enpassant is not None:
+            h ^= ZOBRIST['enpassant'][self.enpassant.col]
+        return h
+
+    def _record_position(self):
+        # self.hash is kept up to date by the move helpers, only the repetition count is new.
+        if self.half_moves == 0:
+            # no earlier position can ever be repeated after an irreversible move.
+            self.repetitions = {}
+        self.repetitions[self.hash] = self.repetitions.get(self.hash, 0) + 1
+
     def _update_moves(self):
         for color in range(2):
             for piece_type in ['q', 'r', 'n', 'b', 'p']:
@@ -526,6 +777,93 @@ class Board:
                         self.lowest_attackers[color][attack.row][attack.col], piece.value
                     )
 
+    def to_fen(self):
+        rows = []
+        for row in self.cells:
+            fen_row = ''
+            empty = 0
+            for piece in row:
+                if piece is None:
+                    empty += 1
+                else:
+                    if empty > 0:
+                        fen_row += str(empty)
+                        empty = 0
+                    fen_row += piece.notation
+            if empty > 0:
+                fen_row += str(empty)
+            rows.append(fen_row)
+        castling = ''.join(notation for notation, right in zip('KQkq', self.castling[0] + self.castling[1]) if right)
+        enpassant = '-' if self.enpassant is None else CellUtils.cell_code(self.enpassant)
+        side = 'w' if self.side_to_move == 0 else 'b'
+        return f"{'/'.join(rows)} {side} {castling or '-'} {enpassant} {self.half_moves} {self.full_moves}"
+
+    def to_bytes(self):
+        # 32 bytes of 4-bit piece codes, then two bytes for each of the 32 feature slots, then
+        # side/castling flags, en-passant square, half and full moves. a slot byte holds a
+        # present bit, an alive bit and the square; the second byte is the mobility a captured
+        # piece had, which its features still report. keeping the slots makes the features of
+        # an unpacked board identical to those of the original.
+        codes = []
+        for row in self.cells:
+            for piece in row:
+                codes.append(0 if piece is None else Board.piece_codes.index(piece.notation))
+        squares = bytes(codes[i] | (codes[i + 1] << 4) for i in range(0, 64, 2))
+        slots = bytearray()
+        for color in range(2):
+            for piece_type, count in Board.feature_slots:
+                listed = self.pieces_for_piece_list[color][piece_type]
+                for i in range(count):
+                    if i >= len(listed):
+                        slots += bytes(2)
+                    else:
+                        piece = listed[i]
+                        slots += bytes((0x80 | (piece.alive << 6) | (piece.row * 8 + piece.col),
+                                        0 if piece.alive else piece.mobility))
+        flags = self.side_to_move
+        for bit, right in enumerate(self.castling[0] + self.castling[1]):
+            flags |= right << (bit + 1)
+        enpassant = 64 if self.enpassant is None else self.enpassant.row * 8 + self.enpassant.col
+        return squares + bytes(slots) + struct.pack('<BBHH', flags, enpassant, self.half_moves, self.full_moves)
+
+    @classmethod
+    def from_bytes(cls, data):
+        # attacks and legal moves are only rebuilt once the position is actually queried.
+        board = cls.__new__(cls)
+        board._reset()
+        for r in range(8):
+            board_row = []
+            for c in range(8):
+                square = r * 8 + c
+                code = (data[square // 2] >> (4 * (square % 2))) & 15
+                board_row.append(None if code == 0 else board._new_piece(Board.piece_codes[code], r, c, listed=False))
+            board.cells.append(board_row)
+        offset = 32
+        for color in range(2):
+            for piece_type, count in Board.feature_slots:
+                for _ in range(count):
+                    slot, mobility = data[offset], data[offset + 1]
+                    offset += 2
+                    if not slot & 0x80:
+                        continue
+                    square = slot & 63
+                    if slot & 0x40:
+                        piece = board.cells[square // 8][square % 8]
+                    else:
+                        # captured pieces only live on in the piece list.
+                        char = piece_type.upper() if color == 0 else piece_type
+                        piece = Board._make_piece(char, square // 8, square % 8)
+                        piece.alive = 0
+                        piece.mobility = mobility
+                    board.pieces_for_piece_list[color][piece_type].append(piece)
+        flags, enpassant, board.half_moves, board.full_moves = struct.unpack('<BBHH', data[offset:Board.packed_size])
+        board.side_to_move = flags & 1
+        board.castling = [[(flags >> 1) & 1, (flags >> 2) & 1], [(flags >> 3) & 1, (flags >> 4) & 1]]
+        if enpassant < 64:
+            board.enpassant = Cell(enpassant // 8, enpassant % 8)
+        board._finish_setup(lazy=True)
+        return board
+
     def __getitem__(self, cell):
         cell = CellUtils.cell(cell)
         return self.cells[cell.row][cell.col]
@@ -574,6 +912,7 @@ class Board:
                 piece = Bishop(color, Cell(r, c))
                 self.pieces[color]['b'].append(piece)
         self.material[color].append(piece)
+        self.hash ^= ZOBRIST['pieces'][color][move.special][r][c]
 
         if self.cells[r][c] is not None:
             self._kill_piece(self.cells[r][c])
@@ -585,68 +924,70 @@ class Board:
                 break
 
         self.cells[r][c] = piece
-        piece.update_attacks(self)
-        piece.update_legals(self)
+
+    def _clear_castling(self, color, c_side):
+        if self.castling[color][c_side] == 1:
+            self.castling[color][c_side] = 0
+            self.hash ^= ZOBRIST['castling'][color][c_side]
 
     def _update_castling(self, move):
         piece = move.piece
         if type(piece) == King:
-            self.castling[piece.color][0] = 0
-            self.castling[piece.color][1] = 0
+            self._clear_castling(piece.color, 0)
+            self._clear_castling(piece.color, 1)
         elif type(piece) == Rook:
             if piece.col == 7:
-                self.castling[piece.color][0] = 0
+                self._clear_castling(piece.color, 0)
             elif piece.col == 0:
-                self.castling[piece.color][1] = 0
+                self._clear_castling(piece.color, 1)
 
     def _castle(self, move):
         col = move.cell.col
-        king_move = Move(move.piece, move.cell, None)
-        self.apply_move(king_move, True)
+        self._move_piece(move.piece, move.cell)
         if col == 6:
             for rook in self.pieces[move.piece.color]['r']:
                 if rook.col == 7:
-                    rook_move = Move(rook, Cell(move.cell.row, 5), None)
-                    self.apply_move(rook_move, True)
+                    self._move_piece(rook, Cell(move.cell.row, 5))
                     break
         else:
             for rook in self.pieces[move.piece.color]['r']:
                 if rook.col == 0:
-                    rook_move = Move(rook, Cell(move.cell.row, 3), None)
-                    self.apply_move(rook_move, True)
+                    self._move_piece(rook, Cell(move.cell.row, 3))
                     break
-        self._update_moves()
 
     def _apply_special_move(self, move):
         if move.special == 'c':
             self._castle(move)
         else:
             self._promote(move)
-            self._update_moves()
 
     def _kill_piece(self, killed):
+        self.hash ^= ZOBRIST['pieces'][killed.color][killed.notation.lower()][killed.row][killed.col]
         killed.alive = 0
         self.material[killed.color].remove(killed)
         self.pieces[killed.color][killed.notation.lower()].remove(killed)
 
+    def _move_piece(self, piece, cell):
+        start_row, start_col = piece.row, piece.col
+        end_row, end_col = cell.row, cell.col
+        if self.cells[end_row][end_col] is not None:
+            self._kill_piece(self.cells[end_row][end_col])
+            self.half_moves = -1
+        moving = self.cells[start_row][start_col]
+        keys = ZOBRIST['pieces'][moving.color][moving.notation.lower()]
+        self.hash ^= keys[start_row][start_col] ^ keys[end_row][end_col]
+        self.cells[end_row][end_col] = moving
+        self.cells[start_row][start_col] = None
+        moving.row, moving.col = end_row, end_col
+
     def apply_move(self, move, inplace=False):
+        self._ensure_moves()
         board = self if inplace else self.copy()
-        was_check = False
         reward = 0
         done = False
-        if board.is_check(move.piece.color):
-            was_check = True
 
         if move.special is None:
-            start_row, start_col = move.piece.row, move.piece.col
-            end_row, end_col = move.cell.row, move.cell.col
-            if board.cells[end_row][end_col] is not None:
-                board._kill_piece(board.cells[end_row][end_col])
-                board.half_moves = -1
-            board.cells[end_row][end_col] = board.cells[start_row][start_col]
-            board.cells[start_row][start_col] = None
-            board.cells[end_row][end_col].row, board.cells[end_row][end_col].col = end_row, end_col
-            board._update_moves()
+            board._move_piece(board.cells[move.piece.row][move.piece.col], move.cell)
             if type(move.piece) == Pawn:
                 board.half_moves = -1
 
@@ -654,28 +995,38 @@ class Board:
             board.half_moves = -1
             board._apply_special_move(move)
 
+        if board.side_to_move == 1:
+            board.full_moves += 1
         board.side_to_move = 1 - board.side_to_move
+        board.hash ^= ZOBRIST['side']
         board._update_castling(move)
-        board._update_attack_maps()
         board.half_moves += 1
-        if board.is_check(board.side_to_move):
-            board._update_moves()
-            if board.is_checkmate(board.side_to_move):
+        board._record_position()
+        # the new position is generated once, after castling rights and the hash are final.
+        check, checkmate = board._refresh_moves()
+        if check:
+            if checkmate:
                 done = True
                 reward = 1
         elif board.is_draw():
             done = True
-        if was_check:
-            board._update_moves()
+        elif Board.endgames is not None:
+            result = Board.endgames.probe(board)
+            if result is not None:
+                # the result is for the side to move, the reward for the side that just moved.
+                done = True
+                reward = -result
         return board, reward, done
 
     def legal_moves(self, color):
+        self._ensure_moves()
         moves = []
         for piece in self.material[color]:
             moves += piece.legal
         return moves
 
     def is_check(self, color):
+        self._ensure_moves()
         king_cell = Cell(self.pieces[color]['k'][0].row, self.pieces[color]['k'][0].col)
         for piece in self.material[1 - color]:
             if king_cell in piece.attacks:
@@ -692,6 +1043,7 @@ class Board:
         return checkmate
 
     def is_stalemate(self, color):
+        self._ensure_moves()
         for soldier in self.material[color]:
             if len(soldier.legal) > 0:
                 return False
@@ -702,8 +1054,13 @@ class Board:
             return True
         return False
 
+    def is_repetition_draw(self):
+        if self.repetitions.get(self.hash, 0) >= 3:
+            return True
+        return False
+
     def is_draw(self):
-        return self.is_fifty_move_draw() or self.is_stalemate(self.side_to_move)
+        return self.is_fifty_move_draw() or self.is_repetition_draw() or self.is_stalemate(self.side_to_move)
 
     def _get_piece_features(self, side):
         result = []
@@ -732,18 +1089,11 @@ class Board:
                 else:
                     result += self.pieces_for_piece_list[color]['b'][i].get_slot(self, side)
 
-            if side == 0:
-                for i in range(8):
-                    if i >= len(self.pieces_for_piece_list[color]['p']):
-                        result += [0, 0, 0, 0, 50, 50]
-                    else:
-                        result += self.pieces_for_piece_list[color]['p'][i].get_slot(self, side)
-            else:
-                for i in range(7, -1, -1):
-                    if i >= len(self.pieces_for_piece_list[color]['p']):
-                        result += [0, 0, 0, 0, 50, 50]
-                    else:
-                        result += self.pieces_for_piece_list[color]['p'][i].get_slot(self, side)
+            for i in range(8) if side == 0 else range(7, -1, -1):
+                if i >= len(self.pieces_for_piece_list[color]['p']):
+                    result += [0, 0, 0, 0, 50, 50]
+                else:
+                    result += self.pieces_for_piece_list[color]['p'][i].get_slot(self, side)
         return result
 
     def _get_global_features(self, side):
@@ -771,11 +1121,18 @@ class Board:
                         result.append(self.lowest_attackers[color][row][col])
         return result
 
-    def get_state(self, side):
+    def get_features(self, side):
+        # the model input as a plain list, so the rules never depend on torch or numpy.
+        self._ensure_moves()
         piece_features = self._get_piece_features(side)
         global_features = self._get_global_features(side)
         attack_map_features = self._get_attack_maps(side)
-        return torch.from_numpy(np.array(global_features + piece_features + attack_map_features).astype(np.float32))
+        return global_features + piece_features + attack_map_features
+
+    def get_state(self, side):
+        # torch is only loaded by the first caller that wants a tensor.
+        import torch
+        return torch.tensor(self.get_features(side), dtype=torch.float32)
 
 
 def play():
@@ -0,0 +1,292 @@
+from chess import *
+from model import DNN
+import argparse
+import json
+import multiprocessing as mp
+import numpy as np
+import os
+import re
+import torch
+import torch.nn as nn
+import torch.optim as optim
+from torch.utils.data import DataLoader, Dataset, Sampler
+
+
+DATASET_HYPERPARAMS = {
+    'shard_rows': 1 << 16,
+    'dtype': 'float16',         # every feature is a multiple of 0.5 below 64, exact in float16
+    'chunk': 64,                # records handed to a worker at a time
+    'workers': os.cpu_count(),
+    'batch_size': 512,
+    'run_rows': 64,             # consecutive rows read at once, a batch is batch_size / run_rows runs
+    'loader_workers': 4,
+    'epochs': 1,
+    'lr': 1e-3,
+}
+
+STATE_SIZE = 333
+RESULTS = {'1-0': 1.0, '0-1': -1.0, '1/2-1/2': 0.0}
+
+
+def read_epd(path):
+    # yields one line at a time, the file is never loaded whole.
+    with open(path) as file:
+        for line in file:
+            line = line.strip()
+            if line and not line.startswith('#'):
+                yield 'epd', line
+
+
+def read_pgn(path):
+    # yields the text of one game at a time: its headers followed by its movetext.
+    with open(path, errors='replace') as file:
+        game = []
+        in_moves = False
+        for line in file:
+            if line.startswith('[') and in_moves:
+                yield 'pgn', ''.join(game)
+                game = []
+                in_moves = False
+            elif line.strip() and not line.startswith('['):
+                in_moves = True
+            game.append(line)
+        if in_moves:
+            yield 'pgn', ''.join(game)
+
+
+def _epd_samples(line):
+    # '<4 fen fields> <opcodes>'. the label comes from a result opcode such as c9 "1-0",
+    # or from a ce centipawn evaluation for the side to move.
+    fields = line.split(None, 4)
+    board = Board(' '.join(fields[:4]) + ' 0 1')
+    side = board.side_to_move
+    ops = fields[4] if len(fields) > 4 else ''
+    for result, value in RESULTS.items():
+        if f'"{result}"' in ops:
+            return [(board.get_features(side), value * (1 - 2*side))]
+    match = re.search(r'\bce\s+(-?\d+)', ops)
+    if match:
+        return [(board.get_features(side), float(np.tanh(int(match.group(1)) / 1000)))]
+    return []
+
+
+def _pgn_samples(text):
+    # every position of the game, labelled with the final result for the side to move. the
+    # game is dropped from the first move that cannot be replayed by chess.py.
+    result = re.search(r'\[Result "([^"]*)"\]', text)
+    if result is None or result.group(1) not in RESULTS:
+        return []
+    value = RESULTS[result.group(1)]
+    fen = re.search(r'\[FEN "([^"]*)"\]', text)
+    board = Board(fen.group(1)) if fen else Board()
+
+    moves = re.sub(r'^\[.*\]$', '', text, flags=re.MULTILINE)
+    moves = re.sub(r'\{[^}]*\}|;[^\n]*|\$\d+', ' ', moves)
+    while '(' in moves:
+        moves = re.sub(r'\([^()]*\)', ' ', moves)
+
+    samples = []
+    for token in moves.split():
+        if re.fullmatch(r'\d+\.+', token) or token in RESULTS or token == '*':
+            continue
+        token = re.sub(r'^\d+\.+', '', token)
+        side = board.side_to_move
+        move = MoveUtils.from_san(board, token)
+        if move is None:
+            break
+        samples.append((board.get_features(side), value * (1 - 2*side)))
+        board, _, done = board.apply_move(move)
+        if done:
+            break
+    return samples
+
+
+def _featurize(records):
+    features, labels = [], []
+    for kind, record in records:
+        try:
+            samples = _epd_samples(record) if kind == 'epd' else _pgn_samples(record)
+        except (ValueError, IndexError, KeyError):
+            continue
+        for state, label in samples:
+            features.append(np.asarray(state, dtype=np.float32))
+            labels.append(label)
+    if len(features) == 0:
+        return np.zeros((0, STATE_SIZE), dtype=np.float32), np.zeros(0, dtype=np.float32)
+    return np.stack(features), np.array(labels, dtype=np.float32)
+
+
+def _chunks(records, size):
+    chunk = []
+    for record in records:
+        chunk.append(record)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+class ShardWriter:
+    # buffers rows and writes them out as .npy shards that can be memory-mapped for reading.
+
+    def __init__(self, folder, dtype=DATASET_HYPERPARAMS['dtype'], shard_rows=DATASET_HYPERPARAMS['shard_rows']):
+        self.folder = folder
+        self.dtype = dtype
+        self.shard_rows = shard_rows
+        self.shards = []
+        self.features = []
+        self.labels = []
+        self.buffered = 0
+        if not os.path.exists(folder):
+            os.makedirs(folder)
+
+    def add(self, features, labels):
+        self.features.append(features)
+        self.labels.append(labels)
+        self.buffered += len(labels)
+        while self.buffered >= self.shard_rows:
+            self._flush(self.shard_rows)
+
+    def _flush(self, rows):
+        features = np.concatenate(self.features)
+        labels = np.concatenate(self.labels)
+        name = f'shard{len(self.shards):05d}'
+        out = np.lib.format.open_memmap(os.path.join(self.folder, f'{name}.features.npy'), mode='w+',
+                                        dtype=self.dtype, shape=(rows, STATE_SIZE))
+        out[:] = features[:rows]
+        out.flush()
+        np.save(os.path.join(self.folder, f'{name}.labels.npy'), labels[:rows])
+        self.shards.append({'name': name, 'rows': rows})
+        self.features, self.labels = [features[rows:]], [labels[rows:]]
+        self.buffered -= rows
+
+    def close(self):
+        if self.buffered > 0:
+            self._flush(self.buffered)
+        index = {'state_size': STATE_SIZE, 'dtype': self.dtype, 'rows': sum(shard['rows'] for shard in self.shards),
+                 'shards': self.shards}
+        with open(os.path.join(self.folder, 'index.json'), 'w') as file:
+            json.dump(index, file, indent=2)
+        return index
+
+
+def build(inputs, folder, workers=DATASET_HYPERPARAMS['workers'], dtype=DATASET_HYPERPARAMS['dtype']):
+    # streams every input through a process pool and writes the featurized positions to folder.
+    def records():
+        for path in inputs:
+            yield from read_pgn(path) if path.endswith('.pgn') else read_epd(path)
+
+    writer = ShardWriter(folder, dtype)
+    with mp.Pool(workers) as pool:
+        for features, labels in pool.imap(_featurize, _chunks(records(), DATASET_HYPERPARAMS['chunk'])):
+            if len(labels) > 0:
+                writer.add(features, labels)
+    return writer.close()
+
+
+class ShardDataset(Dataset):
+    # items are whole batches. the rows of every shard are cut into runs of run_rows consecutive
+    # rows, and an item is a list of run indices read with one slice per run, so a batch costs
+    # a few contiguous reads rather than one python-level read per row.
+    # shards are opened lazily, so every DataLoader worker maps its own view of the files.
+
+    def __init__(self, folder, run_rows=DATASET_HYPERPARAMS['run_rows']):
+        self.folder = folder
+        with open(os.path.join(folder, 'index.json')) as file:
+            self.index = json.load(file)
+        self.runs = []
+        for shard, entry in enumerate(self.index['shards']):
+            for start in range(0, entry['rows'], run_rows):
+                self.runs.append((shard, start, min(start + run_rows, entry['rows'])))
+        self.maps = None
+
+    def __len__(self):
+        return len(self.runs)
+
+    def _open(self):
+        self.maps = []
+        for shard in self.index['shards']:
+            path = os.path.join(self.folder, shard['name'])
+            self.maps.append((np.load(f'{path}.features.npy', mmap_mode='r'),
+                              np.load(f'{path}.labels.npy', mmap_mode='r')))
+
+    def __getitem__(self, runs):
+        if self.maps is None:
+            self._open()
+        features, labels = [], []
+        for shard, start, stop in (self.runs[run] for run in runs):
+            features.append(self.maps[shard][0][start:stop])
+            labels.append(self.maps[shard][1][start:stop])
+        features = torch.from_numpy(np.concatenate(features).astype(np.float32))
+        labels = torch.from_numpy(np.concatenate(labels).astype(np.float32)).unsqueeze(1)
+        return features, labels
+
+
+class RunBatchSampler(Sampler):
+    # yields the run indices of one batch at a time, in a new random order every epoch.
+
+    def __init__(self, dataset, batch_size=DATASET_HYPERPARAMS['batch_size'], run_rows=DATASET_HYPERPARAMS['run_rows'],
+                 shuffle=True):
+        self.runs = len(dataset)
+        self.runs_per_batch = max(1, batch_size // run_rows)
+        self.shuffle = shuffle
+
+    def __len__(self):
+        return (self.runs + self.runs_per_batch - 1) // self.runs_per_batch
+
+    def __iter__(self):
+        order = torch.randperm(self.runs).tolist() if self.shuffle else list(range(self.runs))
+        for start in range(0, self.runs, self.runs_per_batch):
+            yield order[start:start + self.runs_per_batch]
+
+
+def pretrain(folder, epochs=DATASET_HYPERPARAMS['epochs'], lr=DATASET_HYPERPARAMS['lr'],
+             batch_size=DATASET_HYPERPARAMS['batch_size'], workers=DATASET_HYPERPARAMS['loader_workers']):
+    # supervised regression of DNN onto the game results stored in folder.
+    model = DNN()
+    optimizer = optim.AdamW(model.parameters(), lr=lr)
+    loss_fn = nn.MSELoss()
+    # the sampler hands whole batches to the dataset, the loader itself does no batching.
+    dataset = ShardDataset(folder)
+    loader = DataLoader(dataset, sampler=RunBatchSampler(dataset, batch_size), batch_size=None, num_workers=workers,
+                        persistent_workers=workers > 0)
+    for epoch in range(epochs):
+        total, batches = 0.0, 0
+        for features, labels in loader:
+            optimizer.zero_grad()
+            loss = loss_fn(model(features), labels)
+            loss.backward()
+            optimizer.step()
+            total += loss.item()
+            batches += 1
+        print(f'epoch {epoch + 1}: loss {total / max(batches, 1):.4f}')
+    model.save('pretrained.pth')
+    return model
+
+
+def main():
+    parser = argparse.ArgumentParser(description='offline training data for DNN')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    build_parser = commands.add_parser('build', help='featurize EPD/PGN files into memory-mapped shards')
+    build_parser.add_argument('folder')
+    build_parser.add_argument('inputs', nargs='+')
+    build_parser.add_argument('--workers', type=int, default=DATASET_HYPERPARAMS['workers'])
+    build_parser.add_argument('--dtype', choices=['float16', 'float32'], default=DATASET_HYPERPARAMS['dtype'])
+
+    pretrain_parser = commands.add_parser('pretrain', help='supervised pretraining of DNN on built shards')
+    pretrain_parser.add_argument('folder')
+    pretrain_parser.add_argument('--epochs', type=int, default=DATASET_HYPERPARAMS['epochs'])
+    pretrain_parser.add_argument('--lr', type=float, default=DATASET_HYPERPARAMS['lr'])
+
+    args = parser.parse_args()
+    if args.command == 'build':
+        index = build(args.inputs, args.folder, args.workers, args.dtype)
+        print(f'{index["rows"]} positions in {len(index["shards"])} shards')
+    else:
+        pretrain(args.folder, args.epochs, args.lr)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,259 @@
+from chess import *
+from collections import deque
+import argparse
+import os
+
+
+ENDGAME_HYPERPARAMS = {
+    'folder': './endgames',
+    'tables': ['KQK', 'KRK', 'KPK'],    # generated in this order, KPK promotes into the first two
+}
+
+SIZE = 2 * 64 * 64 * 64     # side to move, strong king, weak king, strong piece
+
+
+def _index(side, wk, bk, p):
+    return ((side * 64 + wk) * 64 + bk) * 64 + p
+
+
+def _mirror(square):
+    return (7 - square // 8) * 8 + square % 8
+
+
+def _on_board(row, col):
+    return 0 <= row < 8 and 0 <= col < 8
+
+
+def _steps(square, directions):
+    row, col = square // 8, square % 8
+    return [(row + d_row) * 8 + col + d_col for d_row, d_col in directions if _on_board(row + d_row, col + d_col)]
+
+
+def _rays(square, directions):
+    row, col = square // 8, square % 8
+    rays = []
+    for d_row, d_col in directions:
+        ray = []
+        r, c = row + d_row, col + d_col
+        while _on_board(r, c):
+            ray.append(r * 8 + c)
+            r, c = r + d_row, c + d_col
+        rays.append(ray)
+    return rays
+
+
+KING_DIRECTIONS = [(-1, -1), (-1, 0), (-1, 1), (0, -1), (0, 1), (1, -1), (1, 0), (1, 1)]
+KNIGHT_DIRECTIONS = [(-2, -1), (-2, 1), (-1, -2), (-1, 2), (1, -2), (1, 2), (2, -1), (2, 1)]
+ROOK_DIRECTIONS = [(-1, 0), (1, 0), (0, -1), (0, 1)]
+BISHOP_DIRECTIONS = [(-1, -1), (-1, 1), (1, -1), (1, 1)]
+
+KING_STEPS = [_steps(square, KING_DIRECTIONS) for square in range(64)]
+KING_ZONES = [set(steps) for steps in KING_STEPS]
+
+
+class Retrograde:
+    # solves king + one white piece against a lone black king. black can never win, so a single
+    # bit per position records whether white wins with perfect play. the movement rules are
+    # those of chess.py, on plain square indices so that millions of positions stay tractable.
+
+    def __init__(self, piece_type, promotions=None):
+        self.piece_type = piece_type
+        self.promotions = promotions or {}
+        self.slides = piece_type in ['q', 'r', 'b']
+        self.win = bytearray(SIZE)
+        self.counts = bytearray(SIZE)
+        if piece_type == 'p':
+            self.directions = None
+        elif piece_type == 'n':
+            self.directions = KNIGHT_DIRECTIONS
+        elif piece_type == 'r':
+            self.directions = ROOK_DIRECTIONS
+        elif piece_type == 'b':
+            self.directions = BISHOP_DIRECTIONS
+        else:
+            self.directions = ROOK_DIRECTIONS + BISHOP_DIRECTIONS
+        # squares attacked by the piece on p when only the white king on wk can block it.
+        self.attacks = [[self._attacks(p, {wk}) for wk in range(64)] for p in range(64)]
+
+    def _attacks(self, p, blockers):
+        if self.piece_type == 'p':
+            row, col = p // 8, p % 8
+            return {(row - 1) * 8 + col + d_col for d_col in [-1, 1] if _on_board(row - 1, col + d_col)}
+        if not self.slides:
+            return set(_steps(p, self.directions))
+        attacked = set()
+        for ray in _rays(p, self.directions):
+            for square in ray:
+                attacked.add(square)
+                if square in blockers:
+                    break
+        return attacked
+
+    def _legal(self, side, wk, bk, p):
+        if wk == bk or wk == p or bk == p or bk in KING_ZONES[wk]:
+            return False
+        if self.piece_type == 'p' and p // 8 in [0, 7]:
+            return False
+        # with white to move, black cannot be in check.
+        return side == 1 or bk not in self.attacks[p][wk]
+
+    def _black_moves(self, wk, bk, p):
+        moves = 0
+        for square in KING_STEPS[bk]:
+            if square == wk or square in KING_ZONES[wk]:
+                continue
+            if square == p:
+                if p not in KING_ZONES[wk]:
+                    moves += 1      # the capture leaves bare kings, a draw.
+            elif square not in self.attacks[p][wk]:
+                moves += 1
+        return moves
+
+    def _white_unmoves(self, wk, bk, p):
+        # white-to-move positions that reach (wk, bk, p) with black to move in one white move.
+        for square in KING_STEPS[wk]:
+            if square != p and square != bk and square not in KING_ZONES[bk]:
+                yield square, p
+        if self.piece_type == 'p':
+            row = p // 8
+            if row + 1 <= 6 and p + 8 not in [wk, bk]:
+                yield wk, p + 8
+                if row == 4 and p + 16 not in [wk, bk]:
+                    yield wk, p + 16
+        elif self.slides:
+            for ray in _rays(p, self.directions):
+                for square in ray:
+                    if square == wk or square == bk:
+                        break
+                    yield wk, square
+        else:
+            for square in _steps(p, self.directions):
+                if square != wk and square != bk:
+                    yield wk, square
+
+    def _black_unmoves(self, wk, bk, p):
+        for square in KING_STEPS[bk]:
+            if square != wk and square != p and square not in KING_ZONES[wk]:
+                yield square
+
+    def _promotion_wins(self, wk, bk, p):
+        target = p - 8
+        if p // 8 != 1 or target in [wk, bk]:
+            return False
+        return any(table[_index(1, wk, bk, target)] for table in self.promotions.values())
+
+    def solve(self):
+        queue = deque()
+        for wk in range(64):
+            for bk in range(64):
+                for p in range(64):
+                    if self._legal(1, wk, bk, p):
+                        idx = _index(1, wk, bk, p)
+                        self.counts[idx] = self._black_moves(wk, bk, p)
+                        if self.counts[idx] == 0 and bk in self.attacks[p][wk]:
+                            self.win[idx] = 1
+                            queue.append((1, wk, bk, p))
+                    if self.piece_type == 'p' and self._legal(0, wk, bk, p) and self._promotion_wins(wk, bk, p):
+                        self.win[_index(0, wk, bk, p)] = 1
+                        queue.append((0, wk, bk, p))
+
+        while queue:
+            side, wk, bk, p = queue.popleft()
+            if side == 1:
+                for from_wk, from_p in self._white_unmoves(wk, bk, p):
+                    idx = _index(0, from_wk, bk, from_p)
+                    if not self.win[idx] and self._legal(0, from_wk, bk, from_p):
+                        self.win[idx] = 1
+                        queue.append((0, from_wk, bk, from_p))
+            else:
+                for from_bk in self._black_unmoves(wk, bk, p):
+                    idx = _index(1, wk, from_bk, p)
+                    if not self.win[idx] and self.counts[idx] > 0:
+                        self.counts[idx] -= 1
+                        if self.counts[idx] == 0:
+                            self.win[idx] = 1
+                            queue.append((1, wk, from_bk, p))
+        return self.win
+
+
+def pack_bits(win):
+    packed = bytearray(len(win) // 8)
+    for idx in range(0, len(win), 8):
+        byte = 0
+        for bit in range(8):
+            byte |= win[idx + bit] << bit
+        packed[idx // 8] = byte
+    return bytes(packed)
+
+
+def generate(folder=ENDGAME_HYPERPARAMS['folder'], tables=ENDGAME_HYPERPARAMS['tables']):
+    if not os.path.exists(folder):
+        os.makedirs(folder)
+    solved = {}
+    for name in tables:
+        piece_type = name[1].lower()
+        promotions = {key: solved[key] for key in ['KQK', 'KRK'] if key in solved} if piece_type == 'p' else None
+        solved[name] = Retrograde(piece_type, promotions).solve()
+        with open(os.path.join(folder, f'{name}.bin'), 'wb') as file:
+            file.write(pack_bits(solved[name]))
+        print(f'{name}: {sum(solved[name])} won positions')
+
+
+class EndgameTables:
+    # probes the bitbases for the side to move: 1 win, 0 draw, -1 loss, None if not covered.
+    # bare kings and a lone minor piece are always drawn and need no table.
+
+    def __init__(self, folder=ENDGAME_HYPERPARAMS['folder']):
+        self.tables = {}
+        if os.path.exists(folder):
+            for file_name in os.listdir(folder):
+                if file_name.endswith('.bin'):
+                    with open(os.path.join(folder, file_name), 'rb') as file:
+                        self.tables[file_name[:-4]] = file.read()
+
+    def probe(self, board):
+        if len(board.material[0]) + len(board.material[1]) > 3:
+            return None
+        if len(board.material[0]) + len(board.material[1]) == 2:
+            return 0
+        strong = 0 if len(board.material[0]) == 2 else 1
+        piece = None
+        for candidate in board.material[strong]:
+            if type(candidate) != King:
+                piece = candidate
+        piece_type = piece.notation.lower()
+        if piece_type in ['n', 'b']:
+            return 0
+        table = self.tables.get(f'K{piece_type.upper()}K')
+        if table is None:
+            return None
+
+        strong_king = board.pieces[strong]['k'][0]
+        weak_king = board.pieces[1 - strong]['k'][0]
+        wk = strong_king.row * 8 + strong_king.col
+        bk = weak_king.row * 8 + weak_king.col
+        p = piece.row * 8 + piece.col
+        if strong == 1:
+            wk, bk, p = _mirror(wk), _mirror(bk), _mirror(p)
+        side = board.side_to_move ^ strong
+        idx = _index(side, wk, bk, p)
+        if not (table[idx // 8] >> (idx % 8)) & 1:
+            return 0
+        return 1 if board.side_to_move == strong else -1
+
+
+def load_tables(folder=ENDGAME_HYPERPARAMS['folder']):
+    tables = EndgameTables(folder)
+    return tables if len(tables.tables) > 0 else None
+
+
+def main():
+    parser = argparse.ArgumentParser(description='generate endgame bitbases by retrograde analysis')
+    parser.add_argument('--folder', default=ENDGAME_HYPERPARAMS['folder'])
+    parser.add_argument('tables', nargs='*', default=ENDGAME_HYPERPARAMS['tables'])
+    args = parser.parse_args()
+    generate(args.folder, args.tables)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,198 @@
+from model import *
+import copy
+import numpy as np
+import random
+
+
+# largest absolute difference from DNN accepted for each backend, on the tanh output in [-1, 1].
+# export refuses a backend that exceeds it on the validation states.
+INFERENCE_TOLERANCE = {
+    'fp32': 1e-5,
+    'numpy': 1e-5,
+    'int8': 5e-2,
+}
+
+INFERENCE_HYPERPARAMS = {
+    'fused_batch': 64,      # the fused layout wins up to this batch size, larger batches use the branches
+}
+
+# positions every export is checked on, from both sides: openings, middlegames and endgames.
+VALIDATION_FENS = [
+    'rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1',
+    'r1bqkb1r/pppp1ppp/2n2n2/4p3/2B1P3/5N2/PPPP1PPP/RNBQK2R w KQkq - 4 4',
+    'r2q1rk1/pp2bppp/2n1pn2/3p4/3P4/2NBPN2/PP3PPP/R2Q1RK1 b - - 3 10',
+    '2r2rk1/1b3ppp/p3pn2/1p6/3N4/1B2P3/PP3PPP/2RR2K1 w - - 0 20',
+    '8/5pk1/6p1/8/3R4/6P1/5PKP/3r4 w - - 0 40',
+    '8/8/8/4k3/8/8/3QK3/8 w - - 0 60',
+    '8/8/4k3/8/8/8/4P3/4K3 w - - 0 60',
+    '6k1/1P6/8/8/8/8/6pK/8 b - - 0 55',
+]
+
+_validation_states = None
+
+
+def _fused_weights(model):
+    # rewrites the three-branch DNN as a plain MLP. the first layer is block-diagonal over the
+    # global, piece and attack inputs. the second applies piece_layer_2 to the piece block and
+    # passes the other two through an identity, which relu leaves unchanged. the final /10
+    # before tanh is folded into the output layer.
+    g = MODEL_HYPERPARAMS['global_nodes']
+    p1 = MODEL_HYPERPARAMS['piece_nodes_1']
+    p2 = MODEL_HYPERPARAMS['piece_nodes_2']
+    a = MODEL_HYPERPARAMS['attack_defend_nodes']
+    with torch.no_grad():
+        w1 = torch.zeros(g + p1 + a, 333)
+        w1[:g, :15] = model.global_layer.weight
+        w1[g:g + p1, 15:205] = model.piece_layer_1.weight
+        w1[g + p1:, 205:] = model.attack_defend_layer.weight
+        b1 = torch.concat((model.global_layer.bias, model.piece_layer_1.bias, model.attack_defend_layer.bias))
+
+        w2 = torch.zeros(g + p2 + a, g + p1 + a)
+        w2[:g, :g] = torch.eye(g)
+        w2[g:g + p2, g:g + p1] = model.piece_layer_2.weight
+        w2[g + p2:, g + p1:] = torch.eye(a)
+        b2 = torch.concat((torch.zeros(g), model.piece_layer_2.bias, torch.zeros(a)))
+
+        w3, b3 = model.overall.weight.clone(), model.overall.bias.clone()
+        w4, b4 = model.output.weight / 10, model.output.bias / 10
+    return [(w1, b1), (w2, b2), (w3, b3), (w4, b4)]
+
+
+class Int8Linear(nn.Module):
+    # weight-only int8: one symmetric scale per output row, activations and bias stay fp32.
+    # quantizing the activations as well cannot hold the tolerance, the material channel
+    # carries the first layer's large bias through to the output.
+
+    def __init__(self, weight, bias):
+        super(Int8Linear, self).__init__()
+        scale = weight.abs().amax(dim=1) / 127
+        scale[scale == 0] = 1
+        self.register_buffer('weight', torch.round(weight / scale[:, None]).to(torch.int8))
+        self.register_buffer('scale', scale)
+        self.register_buffer('bias', bias.clone())
+
+    def forward(self, x):
+        return f.linear(x, self.weight.float()) * self.scale + self.bias
+
+
+class FrozenDNN(nn.Module):
+    # the fused layout needs fewer kernels, which is what a single search leaf pays for, but its
+    # block-diagonal layers do about three times the arithmetic of the three branches. batches
+    # above fused_batch are evaluated by a frozen copy of the branch layout instead.
+    # int8 keeps the first fused layer in fp32, it sees the raw features and holds most of the
+    # precision, and stores the later layers as Int8Linear. it always uses the fused layout.
+
+    def __init__(self, model, int8=False):
+        super(FrozenDNN, self).__init__()
+        layers = []
+        for idx, (weight, bias) in enumerate(_fused_weights(model)):
+            if int8 and idx > 0:
+                linear = Int8Linear(weight, bias)
+            else:
+                linear = nn.Linear(weight.shape[1], weight.shape[0])
+                linear.weight.data.copy_(weight)
+                linear.bias.data.copy_(bias)
+            layers += [linear, nn.ReLU()]
+        layers[-1] = nn.Tanh()
+        self.layers = nn.Sequential(*layers)
+        self.branches = None if int8 else copy.deepcopy(model)
+        self.requires_grad_(False)
+        self.eval()
+
+    def forward(self, x):
+        if self.branches is not None and x.dim() > 1 and x.shape[0] > INFERENCE_HYPERPARAMS['fused_batch']:
+            return self.branches(x)
+        return self.layers(x)
+
+
+class NumpyDNN:
+    # the network on plain numpy arrays, for callers that want no torch dispatch at all.
+    # accepts a single state or a batch, as a numpy array or a cpu tensor. fused up to
+    # fused_batch states, as FrozenDNN.
+
+    def __init__(self, model):
+        self.layers = [(weight.numpy().T.copy(), bias.numpy().copy()) for weight, bias in _fused_weights(model)]
+        with torch.no_grad():
+            self.branches = {name: (layer.weight.numpy().T.copy(), layer.bias.numpy().copy())
+                             for name, layer in model.named_children()}
+
+    def _branch_call(self, x):
+        def layer(name, inputs):
+            weight, bias = self.branches[name]
+            return inputs @ weight + bias
+        global_features = np.maximum(layer('global_layer', x[:, :15]), 0)
+        piece_features = np.maximum(layer('piece_layer_1', x[:, 15:205]), 0)
+        piece_features = np.maximum(layer('piece_layer_2', piece_features), 0)
+        attack_defend_features = np.maximum(layer('attack_defend_layer', x[:, 205:]), 0)
+        x = np.concatenate((global_features, piece_features, attack_defend_features), axis=1)
+        x = np.maximum(layer('overall', x), 0)
+        return np.tanh(layer('output', x) / 10)
+
+    def __call__(self, x):
+        x = np.asarray(x, dtype=np.float32)
+        if x.ndim > 1 and x.shape[0] > INFERENCE_HYPERPARAMS['fused_batch']:
+            return self._branch_call(x)
+        for weight, bias in self.layers[:-1]:
+            x = np.maximum(x @ weight + bias, 0)
+        weight, bias = self.layers[-1]
+        return np.tanh(x @ weight + bias)
+
+
+def sample_states(plies, seed=0):
+    # states of a seeded random game, restarted whenever it ends.
+    from chess import Board
+
+    rng = random.Random(seed)
+    board = Board()
+    states = []
+    for _ in range(plies):
+        states.append(board.get_state(board.side_to_move))
+        board, _, done = board.apply_move(rng.choice(board.legal_moves(board.side_to_move)))
+        if done:
+            board = Board()
+    return torch.stack(states)
+
+
+def validation_states():
+    # the states of VALIDATION_FENS, built once per process.
+    global _validation_states
+    if _validation_states is None:
+        from chess import Board
+
+        boards = [Board(fen) for fen in VALIDATION_FENS]
+        _validation_states = torch.stack([board.get_state(side) for board in boards for side in range(2)])
+    return _validation_states
+
+
+def export(model, backend='fp32', states=None, validate=True):
+    # the export is checked against model on states, VALIDATION_FENS by default, and refused
+    # when it deviates more than its tolerance. processes that load weights already validated
+    # elsewhere, such as match workers, skip the check.
+    match backend:
+        case 'fp32':
+            frozen = FrozenDNN(model)
+        case 'int8':
+            frozen = FrozenDNN(model, int8=True)
+        case 'numpy':
+            frozen = NumpyDNN(model)
+        case _:
+            raise ValueError(f'unknown inference backend {backend}')
+    if not validate:
+        return frozen
+    states = validation_states() if states is None else states
+    # checked once per layout, the states are tiled past fused_batch for the batched one.
+    batch = states.repeat(INFERENCE_HYPERPARAMS['fused_batch'] // len(states) + 1, 1)
+    error = max(max_error(model, frozen, states[:INFERENCE_HYPERPARAMS['fused_batch']]), max_error(model, frozen, batch))
+    if error > INFERENCE_TOLERANCE[backend]:
+        raise ValueError(f'{backend} export deviates by {error:.2e}, above its tolerance {INFERENCE_TOLERANCE[backend]:.0e}')
+    return frozen
+
+
+def max_error(model, frozen, states):
+    # largest deviation of frozen from model over a batch of states.
+    with torch.no_grad():
+        expected = model(states).numpy()
+        actual = frozen(states)
+    if isinstance(actual, torch.Tensor):
+        actual = actual.numpy()
+    return float(np.abs(expected - actual).max())
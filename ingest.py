@@ -0,0 +1,311 @@
+from agent import *
+from selfplay import SELFPLAY_HYPERPARAMS
+import argparse
+import asyncio
+import io
+import socket
+import struct
+import threading
+import time
+import zlib
+
+
+INGEST_HYPERPARAMS = {
+    'address': '127.0.0.1:5555',    # host:port, or unix:/path for a unix socket
+    'queue_size': 256,              # trajectories waiting for the learner before actors are held back
+    'max_frame': 64 << 20,
+    'compression': 1,               # zlib level, positions compress well even at the fastest level
+    'report_seconds': 30,
+    'publish_every': 16,            # trajectories trained between two weight versions
+}
+
+# every message is a frame header followed by its payload.
+FRAME = struct.Struct('<BI')
+PUSH, ACK, PULL, WEIGHTS = 1, 2, 3, 4
+
+# a batch starts with its trajectory count and the packed board size, so that an actor with a
+# different board layout is refused instead of misread. a trajectory is its ply count and winner
+# (-1 for a draw), the packed position before every ply and after the last one, then the
+# encoded moves and the rewards.
+BATCH = struct.Struct('<IH')
+TRAJECTORY = struct.Struct('<Hb')
+
+
+def pack_trajectories(trajectories):
+    chunks = [BATCH.pack(len(trajectories), Board.packed_size)]
+    for trajectory in trajectories:
+        plies = len(trajectory['plies'])
+        winner = -1 if trajectory['winner'] is None else trajectory['winner']
+        chunks.append(TRAJECTORY.pack(plies, winner))
+        chunks.extend(trajectory['positions'])
+        chunks.append(struct.pack(f'<{plies}H', *(code for _, code, _ in trajectory['plies'])))
+        chunks.append(struct.pack(f'<{plies}b', *trajectory['rewards']))
+    return b''.join(chunks)
+
+
+def unpack_trajectories(data):
+    trajectories = []
+    count, packed_size = BATCH.unpack_from(data)
+    if packed_size != Board.packed_size:
+        raise ValueError(f'positions packed in {packed_size} bytes, expected {Board.packed_size}')
+    offset = BATCH.size
+    for _ in range(count):
+        plies, winner = TRAJECTORY.unpack_from(data, offset)
+        offset += TRAJECTORY.size
+        positions = [data[offset + i * Board.packed_size:offset + (i + 1) * Board.packed_size] for i in range(plies + 1)]
+        offset += (plies + 1) * Board.packed_size
+        moves = list(struct.unpack_from(f'<{plies}H', data, offset))
+        offset += 2 * plies
+        rewards = list(struct.unpack_from(f'<{plies}b', data, offset))
+        offset += plies
+        trajectories.append({'positions': positions, 'moves': moves, 'rewards': rewards,
+                             'winner': None if winner == -1 else winner})
+    return trajectories
+
+
+def _parse_address(address):
+    if address.startswith('unix:'):
+        return socket.AF_UNIX, address[5:]
+    host, port = address.rsplit(':', 1)
+    return socket.AF_INET, (host, int(port))
+
+
+class IngestServer:
+    # accepts trajectory batches from remote actors on an asyncio loop running in a background
+    # thread, and serves them the latest published weights. a batch is only acknowledged once
+    # it fits in the queue, so a learner that falls behind holds the actors back instead of
+    # buffering without bound.
+
+    def __init__(self, address=INGEST_HYPERPARAMS['address'], queue_size=INGEST_HYPERPARAMS['queue_size'],
+                 report_seconds=INGEST_HYPERPARAMS['report_seconds']):
+        self.address = address
+        self.queue_size = queue_size
+        self.report_seconds = report_seconds
+        self.weights = (0, b'')
+        self.stats = {'clients': 0, 'batches': 0, 'trajectories': 0, 'plies': 0, 'bytes': 0, 'consumed': 0,
+                      'stalled': 0.0, 'pulls': 0}
+        self.loop = asyncio.new_event_loop()
+        self.ready = threading.Event()
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+        self.ready.wait()
+
+    def _run(self):
+        asyncio.set_event_loop(self.loop)
+        self.loop.run_until_complete(self._start())
+        self.ready.set()
+        self.loop.run_forever()
+        self.server.close()
+        self.loop.run_until_complete(self.server.wait_closed())
+        self.loop.close()
+
+    async def _start(self):
+        self.queue = asyncio.Queue(self.queue_size)
+        family, target = _parse_address(self.address)
+        if family == socket.AF_UNIX:
+            if os.path.exists(target):
+                os.remove(target)
+            self.server = await asyncio.start_unix_server(self._handle, target)
+        else:
+            self.server = await asyncio.start_server(self._handle, *target)
+        if self.report_seconds:
+            self.loop.create_task(self._report())
+
+    async def _handle(self, reader, writer):
+        self.stats['clients'] += 1
+        try:
+            while True:
+                kind, length = FRAME.unpack(await reader.readexactly(FRAME.size))
+                if length > INGEST_HYPERPARAMS['max_frame']:
+                    break
+                payload = await reader.readexactly(length)
+                if kind == PUSH:
+                    data = await self.loop.run_in_executor(None, zlib.decompress, payload)
+                    trajectories = unpack_trajectories(data)
+                    start = time.perf_counter()
+                    for trajectory in trajectories:
+                        await self.queue.put(trajectory)
+                    self.stats['stalled'] += time.perf_counter() - start
+                    self.stats['batches'] += 1
+                    self.stats['trajectories'] += len(trajectories)
+                    self.stats['plies'] += sum(len(trajectory['moves']) for trajectory in trajectories)
+                    self.stats['bytes'] += FRAME.size + length
+                    writer.write(FRAME.pack(ACK, 4) + struct.pack('<I', self.weights[0]))
+                elif kind == PULL:
+                    known, = struct.unpack('<I', payload)
+                    version, blob = self.weights
+                    body = b'' if version == known else blob
+                    writer.write(FRAME.pack(WEIGHTS, 4 + len(body)) + struct.pack('<I', version) + body)
+                    self.stats['pulls'] += 1
+                else:
+                    break
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        except (ValueError, zlib.error, struct.error) as error:
+            # a corrupt or foreign batch drops its actor, never the server.
+            print(f'>> ingest: dropping actor, {error}')
+        finally:
+            self.stats['clients'] -= 1
+            writer.close()
+
+    async def _report(self):
+        last, last_time = dict(self.stats), time.perf_counter()
+        while True:
+            await asyncio.sleep(self.report_seconds)
+            now = time.perf_counter()
+            elapsed = now - last_time
+            rate = {key: (self.stats[key] - last[key]) / elapsed for key in ['trajectories', 'plies', 'bytes', 'consumed']}
+            print(f'>> ingest: {rate["trajectories"]:.2f} games/s, {rate["plies"]:.1f} plies/s, '
+                  f'{rate["bytes"] / 1024:.1f} KB/s, trained {rate["consumed"]:.2f} games/s, '
+                  f'queue {self.queue.qsize()}/{self.queue_size}, stalled {self.stats["stalled"] - last["stalled"]:.1f}s, '
+                  f'{self.stats["clients"]} actors, weights v{self.weights[0]}')
+            last, last_time = dict(self.stats), now
+
+    def get(self):
+        # blocks the learner until a trajectory is available.
+        trajectory = asyncio.run_coroutine_threadsafe(self.queue.get(), self.loop).result()
+        self.stats['consumed'] += 1
+        return trajectory
+
+    def publish(self, agent):
+        # serialized and compressed once here, then served as is to every actor that asks.
+        buffer = io.BytesIO()
+        torch.save({'model': agent.model.state_dict(), 'epsilon': agent.epsilon}, buffer)
+        blob = zlib.compress(buffer.getvalue(), INGEST_HYPERPARAMS['compression'])
+        self.weights = (self.weights[0] + 1, blob)
+        return self.weights[0]
+
+    def close(self):
+        if self.thread.is_alive():
+            self.loop.call_soon_threadsafe(self.loop.stop)
+            self.thread.join()
+
+
+class IngestClient:
+    # blocking client used by self-play actors.
+
+    def __init__(self, address=INGEST_HYPERPARAMS['address']):
+        family, target = _parse_address(address)
+        self.sock = socket.socket(family, socket.SOCK_STREAM)
+        self.sock.connect(target)
+        if family == socket.AF_INET:
+            self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.version = 0
+        self.server_version = 0
+
+    def _recv(self, size):
+        data = bytearray()
+        while len(data) < size:
+            chunk = self.sock.recv(size - len(data))
+            if not chunk:
+                raise ConnectionError('ingest server closed the connection')
+            data += chunk
+        return bytes(data)
+
+    def _request(self, kind, payload):
+        self.sock.sendall(FRAME.pack(kind, len(payload)) + payload)
+        _, length = FRAME.unpack(self._recv(FRAME.size))
+        return self._recv(length)
+
+    def push(self, trajectories):
+        # returns once the server has queued the batch, which is how backpressure reaches the actor.
+        payload = zlib.compress(pack_trajectories(trajectories), INGEST_HYPERPARAMS['compression'])
+        self.server_version, = struct.unpack('<I', self._request(PUSH, payload))
+        return self.server_version
+
+    def pull(self):
+        # the newest weights as {'model', 'epsilon'}, None when ours are already current.
+        reply = self._request(PULL, struct.pack('<I', self.version))
+        version, = struct.unpack_from('<I', reply)
+        if len(reply) == 4:
+            return None
+        self.version = version
+        return torch.load(io.BytesIO(zlib.decompress(reply[4:])), map_location='cpu')
+
+    def close(self):
+        self.sock.close()
+
+
+def actor(address=INGEST_HYPERPARAMS['address'], games=SELFPLAY_HYPERPARAMS['games']):
+    # plays vectorized self-play without learning and ships the finished games to the learner.
+    # every acknowledgement carries the current weight version, new weights are fetched as
+    # soon as the learner publishes them.
+    agent = Agent()
+    agent.load_book()
+    Board.endgames = load_tables()
+    client = IngestClient(address)
+    env = VecSelfPlay(agent, games)
+    client.server_version = None
+    while True:
+        if client.server_version != client.version:
+            state = client.pull()
+            if state is not None:
+                agent.model.load_state_dict(state['model'])
+                agent.epsilon = state['epsilon']
+            client.server_version = client.version
+        finished = env.step(None, learn=False)
+        if len(finished) > 0:
+            client.push(finished)
+
+
+def learner(address=INGEST_HYPERPARAMS['address'], resume=False):
+    # trains on the games pushed by remote actors, in the order they arrive.
+    agent = Agent()
+    book = BookBuilder()
+    if resume and os.path.exists(TRAIN_HYPERPARAMS['book']):
+        # the book is rewritten from the builder, which must start from what is already there.
+        book.merge_file(TRAIN_HYPERPARAMS['book'])
+    losses = deque(maxlen=100)
+    state = load_latest() if resume else None
+    if state is not None:
+        losses.extend(agent.restore(state))
+    checkpoints = CheckpointWriter()
+    server = IngestServer(address)
+    server.publish(agent)
+
+    while True:
+        trajectory = server.get()
+        if agent.episodes % 100 == 0:
+            checkpoints.submit(agent, losses, int(agent.episodes/100))
+            if len(book.entries) > 0:
+                book.write(TRAIN_HYPERPARAMS['book'])
+
+        boards = [Board.from_bytes(position) for position in trajectory['positions']]
+        states, rewards, next_states, eligibilities, plies = [], [], [], {}, []
+        for idx, (move, reward) in enumerate(zip(trajectory['moves'], trajectory['rewards'])):
+            board, next_board = boards[idx], boards[idx + 1]
+            states.append(board.get_state(board.side_to_move))
+            next_states.append(next_board.get_state(1 - next_board.side_to_move))
+            rewards.append(reward)
+            plies.append((board.hash, move, board.side_to_move))
+            agent.train(states, rewards, next_states, eligibilities, idx == len(trajectory['moves']) - 1, losses)
+
+        book.add_game(plies, trajectory['winner'])
+        agent.episodes += 1
+        agent.epsilon = 0.75 / int(1 + agent.episodes/200)
+        if agent.episodes % INGEST_HYPERPARAMS['publish_every'] == 0:
+            server.publish(agent)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='distributed self-play over TCP or unix sockets')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    learner_parser = commands.add_parser('learner', help='receive trajectories and train')
+    learner_parser.add_argument('--address', default=INGEST_HYPERPARAMS['address'])
+    learner_parser.add_argument('--resume', action='store_true')
+
+    actor_parser = commands.add_parser('actor', help='play self-play games and push them to a learner')
+    actor_parser.add_argument('--address', default=INGEST_HYPERPARAMS['address'])
+    actor_parser.add_argument('--games', type=int, default=SELFPLAY_HYPERPARAMS['games'])
+
+    args = parser.parse_args()
+    if args.command == 'learner':
+        learner(args.address, args.resume)
+    else:
+        actor(args.address, args.games)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,175 @@
+from agent import Agent, _winner
+from chess import *
+from endgame import load_tables
+import argparse
+import functools
+import json
+import math
+import multiprocessing as mp
+import os
+import random
+import torch
+
+
+MATCH_HYPERPARAMS = {
+    'games': 32,
+    'depth': 2,
+    'max_plies': 300,
+    'workers': os.cpu_count(),
+    'backend': 'fp32',
+    'random_plies': 4,          # seeded random moves played after the opening, so no two pairs repeat
+    'sprt': None,               # (elo0, elo1) to stop early once either hypothesis is accepted
+    'min_games': 16,            # games played before the sequential test may stop the match
+    'alpha': 0.05,
+    'beta': 0.05,
+}
+
+# each opening is played twice, once with each engine as white. the search is deterministic, so
+# pairs are told apart by a few random plies seeded with the pair index.
+OPENINGS = [
+    'rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1',
+    'rnbqkbnr/pppp1ppp/8/4p3/4P3/8/PPPP1PPP/RNBQKBNR w KQkq - 0 2',
+    'rnbqkbnr/ppp1pppp/8/3p4/3P4/8/PPP1PPPP/RNBQKBNR w KQkq - 0 2',
+    'rnbqkbnr/pp1ppppp/8/2p5/4P3/8/PPPP1PPP/RNBQKBNR w KQkq - 0 2',
+    'rnbqkbnr/pppp1ppp/4p3/8/4P3/8/PPPP1PPP/RNBQKBNR w KQkq - 0 2',
+    'rnbqkbnr/pp1ppppp/2p5/8/4P3/8/PPPP1PPP/RNBQKBNR w KQkq - 0 2',
+    'rnbqkbnr/pppp1ppp/8/4p3/2P5/8/PP1PPPPP/RNBQKBNR w KQkq - 0 2',
+    'rnbqkb1r/pppppppp/5n2/8/8/5N2/PPPPPPPP/RNBQKB1R w KQkq - 2 2',
+]
+
+_players = {}
+
+
+def _load(player, validate=True):
+    # a player is a path to saved weights or a state dict.
+    agent = Agent()
+    state = torch.load(player, map_location='cpu') if isinstance(player, str) else player
+    if 'model' in state:
+        state = state['model']      # a full checkpoint rather than bare weights
+    agent.model.load_state_dict(state)
+    agent.freeze(MATCH_HYPERPARAMS['backend'], validate)
+    return agent
+
+
+def _init_worker(player_a, player_b):
+    # the exports were validated once by run_match before the pool started.
+    _players['a'] = _load(player_a, validate=False)
+    _players['b'] = _load(player_b, validate=False)
+    Board.endgames = load_tables()
+
+
+def _opening(pair, random_plies=MATCH_HYPERPARAMS['random_plies']):
+    # the same position for both games of a pair, whatever worker plays them.
+    rng = random.Random(pair)
+    while True:
+        board = Board(OPENINGS[pair % len(OPENINGS)])
+        for _ in range(random_plies):
+            board, _, done = board.apply_move(rng.choice(board.legal_moves(board.side_to_move)))
+            if done:
+                break
+        else:
+            return board
+
+
+def _play_game(game, depth=MATCH_HYPERPARAMS['depth'], max_plies=MATCH_HYPERPARAMS['max_plies']):
+    # returns the score of engine a: 1 win, 0.5 draw, 0 loss.
+    a_color = game % 2
+    board = _opening(game // 2)
+    _players['a'].new_game()
+    _players['b'].new_game()
+    adjudication = {'draw': 0, 'resign': 0}
+    for _ in range(max_plies):
+        mover = board.side_to_move
+        agent = _players['a'] if mover == a_color else _players['b']
+        agent.new_search(board)
+        move, score = agent._minimax_search_alpha_beta(board, depth, -2.0, 2.0)
+        board, reward, done = board.apply_move(move)
+        if not done:
+            reward, done = Agent.adjudicate(score, mover, adjudication)
+        if done:
+            winner = _winner(reward, mover)
+            if winner is None:
+                return 0.5
+            return 1.0 if winner == a_color else 0.0
+    return 0.5
+
+
+def _expected_score(elo):
+    return 1 / (1 + 10 ** (-elo / 400))
+
+
+def _elo(score):
+    score = min(max(score, 1e-6), 1 - 1e-6)
+    return -400 * math.log10(1 / score - 1)
+
+
+def summarize(results, sprt=MATCH_HYPERPARAMS['sprt'], alpha=MATCH_HYPERPARAMS['alpha'], beta=MATCH_HYPERPARAMS['beta']):
+    games = len(results)
+    wins, draws = results.count(1.0), results.count(0.5)
+    losses = games - wins - draws
+    score = sum(results) / games
+    variance = sum((result - score) ** 2 for result in results) / games
+    margin = 1.96 * math.sqrt(variance / games)
+    report = {
+        'games': games, 'wins': wins, 'draws': draws, 'losses': losses,
+        'score': score,
+        'elo': _elo(score),
+        'elo_ci95': [_elo(score - margin), _elo(score + margin)],
+    }
+    if sprt is not None:
+        # normal approximation of the log-likelihood ratio between elo0 and elo1.
+        s0, s1 = _expected_score(sprt[0]), _expected_score(sprt[1])
+        # floored, a side that wins every game has no variance and must still stop the match.
+        llr = games * (s1 - s0) * (2 * score - s0 - s1) / (2 * max(variance, 1e-6))
+        lower, upper = math.log(beta / (1 - alpha)), math.log((1 - beta) / alpha)
+        if llr >= upper:
+            result = 'H1'
+        elif llr <= lower:
+            result = 'H0'
+        else:
+            result = None
+        report['sprt'] = {'elo0': sprt[0], 'elo1': sprt[1], 'llr': llr, 'bounds': [lower, upper], 'result': result}
+    return report
+
+
+def run_match(player_a, player_b, games=MATCH_HYPERPARAMS['games'], workers=MATCH_HYPERPARAMS['workers'],
+              sprt=MATCH_HYPERPARAMS['sprt'], report_path=None, depth=MATCH_HYPERPARAMS['depth']):
+    # plays games between the two players on a process pool and returns the report of engine a.
+    results = []
+    play = functools.partial(_play_game, depth=depth)
+    for player in [player_a, player_b]:
+        _load(player)
+    # spawned rather than forked, the caller may be a training process with threads running.
+    with mp.get_context('spawn').Pool(workers, initializer=_init_worker, initargs=(player_a, player_b)) as pool:
+        for result in pool.imap_unordered(play, range(games)):
+            results.append(result)
+            if sprt is None or len(results) < MATCH_HYPERPARAMS['min_games']:
+                continue
+            if summarize(results, sprt)['sprt']['result'] is not None:
+                pool.terminate()
+                break
+    report = summarize(results, sprt)
+    report['model_a'] = player_a if isinstance(player_a, str) else 'current'
+    report['model_b'] = player_b if isinstance(player_b, str) else 'current'
+    if report_path is not None:
+        with open(report_path, 'w') as file:
+            json.dump(report, file, indent=2)
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description='play a match between two saved DNN checkpoints')
+    parser.add_argument('model_a')
+    parser.add_argument('model_b')
+    parser.add_argument('--games', type=int, default=MATCH_HYPERPARAMS['games'])
+    parser.add_argument('--workers', type=int, default=MATCH_HYPERPARAMS['workers'])
+    parser.add_argument('--depth', type=int, default=MATCH_HYPERPARAMS['depth'])
+    parser.add_argument('--sprt', type=float, nargs=2, metavar=('ELO0', 'ELO1'))
+    parser.add_argument('--report', default='match.json')
+    args = parser.parse_args()
+    report = run_match(args.model_a, args.model_b, args.games, args.workers, args.sprt, args.report, args.depth)
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -48,21 +48,21 @@ class DNN(nn.Module):
         nn.init.constant_(self.output.bias, -80)
 
     def forward(self, x):
-        global_features = x[:15]
+        global_features = x[..., :15]
         global_features = self.global_layer(global_features)
         global_features = f.relu(global_features)
 
-        piece_features = x[15:205]
+        piece_features = x[..., 15:205]
         piece_features = self.piece_layer_1(piece_features)
         piece_features = f.relu(piece_features)
         piece_features = self.piece_layer_2(piece_features)
         piece_features = f.relu(piece_features)
 
-        attack_defend_features = x[205:]
+        attack_defend_features = x[..., 205:]
         attack_defend_features = self.attack_defend_layer(attack_defend_features)
         attack_defend_features = f.relu(attack_defend_features)
 
-        x = torch.concat((global_features, piece_features, attack_defend_features))
+        x = torch.concat((global_features, piece_features, attack_defend_features), dim=-1)
         x = self.overall(x)
         x = f.relu(x)
         x = self.output(x)
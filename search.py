@@ -0,0 +1,229 @@
+from chess import *
+from array import array
+import multiprocessing as mp
+import queue
+import random
+import struct
+import time
+
+
+SEARCH_HYPERPARAMS = {
+    'tt_size': 1 << 20,     # entries, rounded down to a power of two
+    'workers': 1,
+}
+
+EXACT, LOWER, UPPER = 0, 1, 2
+
+
+class SearchAborted(Exception):
+    pass
+
+
+class TranspositionTable:
+    # fixed-size table. each entry is two 64-bit words: the position hash xor-ed with the data
+    # word, and the data word itself. a torn write from another process makes the pair
+    # inconsistent and the entry simply reads as a miss, so no locking is needed.
+    # entries are tagged with the search that wrote them. a deeper entry of the running search
+    # is kept over a shallower one, anything left from earlier searches may be replaced.
+    # bit 63 is set in every data word, so a stored entry never looks like an empty slot.
+
+    def __init__(self, size=SEARCH_HYPERPARAMS['tt_size'], shared=False):
+        self.size = 1 << (size.bit_length() - 1)
+        self.mask = self.size - 1
+        if shared:
+            self.keys = mp.RawArray('Q', self.size)
+            self.data = mp.RawArray('Q', self.size)
+        else:
+            self.keys = array('Q', bytes(8 * self.size))
+            self.data = array('Q', bytes(8 * self.size))
+        self.generation = 0
+
+    def new_search(self):
+        # ages every entry at once, nothing is cleared between the moves of a game.
+        self.generation = (self.generation + 1) & 63
+
+    def _pack(self, depth, flag, score, move_code):
+        score_bits = struct.unpack('<I', struct.pack('<f', score))[0]
+        return score_bits | (depth << 32) | (flag << 40) | (move_code << 42) | (self.generation << 57) | (1 << 63)
+
+    @staticmethod
+    def _unpack(data):
+        score = struct.unpack('<f', struct.pack('<I', data & 0xffffffff))[0]
+        return (data >> 32) & 0xff, (data >> 40) & 3, score, (data >> 42) & 0x7fff
+
+    def probe(self, key):
+        # returns (depth, flag, score, move_code) or None.
+        idx = key & self.mask
+        data = self.data[idx]
+        if data == 0 or self.keys[idx] ^ data != key:
+            return None
+        return self._unpack(data)
+
+    def store(self, key, depth, flag, score, move_code):
+        idx = key & self.mask
+        old = self.data[idx]
+        if old != 0 and self.keys[idx] ^ old != key and (old >> 57) & 63 == self.generation and (old >> 32) & 0xff > depth:
+            return
+        data = self._pack(depth, flag, score, move_code)
+        self.keys[idx] = key ^ data
+        self.data[idx] = data
+
+    def clear(self):
+        memoryview(self.keys).cast('B')[:] = bytes(8 * self.size)
+        memoryview(self.data).cast('B')[:] = bytes(8 * self.size)
+
+
+def _lazy_smp_worker(agent, worker_id, tt, tasks, stop, results):
+    # helpers search the same root with their own move order, odd helpers skip ahead one ply
+    # so the workers are spread over neighbouring depths and fill the shared table for each other.
+    # every search ends with a (search, worker, None) message once the worker is idle again.
+    agent.tt = tt
+    agent.stop = stop
+    if worker_id > 0:
+        agent.move_rng = random.Random(worker_id)
+    while True:
+        task = tasks.get()
+        if task is None:
+            break
+        search_id, position, repetitions, depth, generation = task
+        board = Board.from_bytes(position)
+        board.repetitions = repetitions
+        tt.generation = generation
+        try:
+            for d in range(1 + worker_id % 2, depth + 1):
+                move, score = agent._minimax_search_alpha_beta(board, d, -2.0, 2.0)
+                results.put((search_id, worker_id, d, None if move is None else MoveUtils.encode(move), score))
+        except SearchAborted:
+            pass
+        results.put((search_id, worker_id, None, None, None))
+
+
+class LazySMPPool:
+    # worker processes kept between searches. they are forked once with the agent, whose model
+    # weights are moved to shared memory so training updates reach them, and share the
+    # transposition table. a search only sends them the packed root position.
+
+    def __init__(self, agent, workers, tt):
+        self.workers = workers
+        self.tt = tt
+        self.inference = agent.inference
+        self.search_id = 0
+        agent.model.share_memory()
+        ctx = mp.get_context('fork') if 'fork' in mp.get_all_start_methods() else mp.get_context()
+        self.stop = ctx.Event()
+        self.results = ctx.Queue()
+        self.tasks = [ctx.Queue() for _ in range(workers)]
+        self.processes = [ctx.Process(target=_lazy_smp_worker, daemon=True,
+                                      args=(agent, worker_id, tt, self.tasks[worker_id], self.stop, self.results))
+                          for worker_id in range(workers)]
+        for process in self.processes:
+            process.start()
+
+    def search(self, board, depth):
+        # returns the best move and score of the deepest iteration any worker completed, and
+        # that depth. the others are stopped as soon as one reaches depth.
+        self.search_id += 1
+        self.stop.clear()
+        position = board.to_bytes()
+        for tasks in self.tasks:
+            tasks.put((self.search_id, position, dict(board.repetitions), depth, self.tt.generation))
+
+        best_depth, best_code, best_score = 0, None, None
+        idle = 0
+        while idle < self.workers:
+            try:
+                search_id, _, d, code, score = self.results.get(timeout=0.1)
+            except queue.Empty:
+                if not all(process.is_alive() for process in self.processes):
+                    raise RuntimeError('a lazy smp worker died')
+                continue
+            if search_id != self.search_id:
+                continue
+            if d is None:
+                idle += 1
+            elif d > best_depth:
+                best_depth, best_code, best_score = d, code, score
+                if best_depth >= depth:
+                    self.stop.set()
+
+        move = None if best_code is None else MoveUtils.decode(board, best_code)
+        return move, best_score, best_depth
+
+    def close(self):
+        for tasks in self.tasks:
+            tasks.put(None)
+        for process in self.processes:
+            process.join(timeout=1)
+            if process.is_alive():
+                process.terminate()
+
+
+def lazy_smp_search(agent, board, depth, workers=SEARCH_HYPERPARAMS['workers'], tt=None):
+    # runs workers processes on the same root and returns the best move and score of the
+    # deepest iteration any of them completed. the pool is kept on the agent and only rebuilt
+    # when the worker count, the table or the inference export changes. without a table the
+    # pool's own is cleared and reused.
+    pool = agent.smp_pool
+    if tt is None:
+        tt = pool.tt if pool is not None and pool.workers == workers else TranspositionTable(shared=True)
+        tt.clear()
+    if pool is None or pool.workers != workers or pool.tt is not tt or pool.inference is not agent.inference:
+        if pool is not None:
+            pool.close()
+        pool = agent.smp_pool = LazySMPPool(agent, workers, tt)
+    return pool.search(board, depth)
+
+
+def principal_variation(agent, board, depth):
+    # follows the best moves stored in the transposition table from board.
+    moves = []
+    if agent.tt is None:
+        return moves
+    for _ in range(depth):
+        entry = agent.tt.probe(board.hash)
+        move = None if entry is None else MoveUtils.decode(board, entry[3])
+        if move is None:
+            break
+        moves.append(move)
+        board, _, done = board.apply_move(move)
+        if done:
+            break
+    return moves
+
+
+def iterative_deepening(agent, board, depth, stop=None, report=None):
+    # searches depth 1, 2, ... up to depth and returns the result of the deepest completed
+    # iteration. setting stop aborts the running iteration at the next node. report is called
+    # after every iteration with (depth, score, nodes, seconds, principal variation).
+    # when the game followed the expected line of the previous search, the iterations that
+    # search already covered are skipped and the root entry it left stands in for them.
+    best_move, best_score = None, None
+    first = agent.new_search(board)
+    if first > 1:
+        entry = agent.tt.probe(board.hash)
+        best_move = None if entry is None or entry[0] < first - 1 else MoveUtils.decode(board, entry[3])
+        best_score = None if best_move is None else entry[2]
+        first = first if best_move is not None else 1
+    completed = first - 1
+    nodes = agent.nodes
+    agent.stop = stop
+    start = time.perf_counter()
+    try:
+        for d in range(first, depth + 1):
+            move, score = agent._minimax_search_alpha_beta(board, d, -2.0, 2.0)
+            if move is None:
+                break
+            best_move, best_score, completed = move, score, d
+            if report is not None:
+                pv = principal_variation(agent, board, d) or [move]
+                report(d, score, agent.nodes - nodes, time.perf_counter() - start, pv)
+            if abs(score) >= 1.0:
+                break
+    except SearchAborted:
+        pass
+    finally:
+        agent.stop = None
+    if best_move is None:
+        best_move = board.legal_moves(board.side_to_move)[0]
+    agent.expect(board, completed)
+    return best_move, best_score
@@ -0,0 +1,122 @@
+from chess import *
+import random
+import torch
+
+
+SELFPLAY_HYPERPARAMS = {
+    'games': 16,
+    'depth': 2,
+}
+
+
+class VecSelfPlay:
+    # advances several independent games in lockstep. every ply, the search frontier of every
+    # game is expanded full-width and all leaves are evaluated by the model in a single batch.
+
+    def __init__(self, agent, games=SELFPLAY_HYPERPARAMS['games'], depth=SELFPLAY_HYPERPARAMS['depth']):
+        self.agent = agent
+        self.depth = depth
+        self.boards = [Board() for _ in range(games)]
+        self.trajectories = [self._new_trajectory() for _ in range(games)]
+        self.leaf_evaluations = 0
+
+    @staticmethod
+    def _new_trajectory():
+        return {'states': [], 'rewards': [], 'next_states': [], 'eligibilities': {},
+                'adjudication': {'draw': 0, 'resign': 0}, 'plies': [], 'positions': [], 'winner': None}
+
+    def _expand(self, board, depth, leaves):
+        # builds the search tree below board. leaves are appended to the shared batch and
+        # referenced by index so that one forward pass can serve every game.
+        side = board.side_to_move
+        children = []
+        for move in board.legal_moves(side):
+            next_board, reward, done = board.apply_move(move)
+            if done:
+                children.append((move, ('value', float(reward) * (1 - 2*side))))
+            elif depth == 1:
+                leaf_side = next_board.side_to_move
+                leaves.append(next_board.get_state(leaf_side))
+                children.append((move, ('leaf', len(leaves) - 1, 1 - 2*leaf_side)))
+            else:
+                children.append((move, self._expand(next_board, depth - 1, leaves)))
+        return 'node', side, children
+
+    def _backup(self, node, values):
+        match node[0]:
+            case 'value':
+                return None, node[1]
+            case 'leaf':
+                return None, values[node[1]] * node[2]
+        side, children = node[1], node[2]
+        best_move = None
+        best_score = -2.0 if side == 0 else 2.0
+        for move, child in children:
+            score = self._backup(child, values)[1]
+            if (side == 0 and score > best_score) or (side == 1 and score < best_score):
+                best_score = score
+                best_move = move
+        return best_move, best_score
+
+    def _search(self, greedy):
+        trees = []
+        leaves = []
+        book_moves = []
+        for board in self.boards:
+            book_moves.append(None if self.agent.book is None else self.agent.book.sample(board))
+            if book_moves[-1] is not None:
+                trees.append(None)
+            elif greedy and random.random() < self.agent.epsilon:
+                trees.append(None)
+            else:
+                trees.append(self._expand(board, self.depth, leaves))
+
+        values = []
+        if len(leaves) > 0:
+            with torch.no_grad():
+                evaluator = self.agent.model if self.agent.inference is None else self.agent.inference
+                values = evaluator(torch.stack(leaves)).reshape(-1).tolist()
+            self.leaf_evaluations += len(leaves)
+
+        actions = []
+        for board, tree, book_move in zip(self.boards, trees, book_moves):
+            if book_move is not None:
+                actions.append((book_move, None))
+            elif tree is None:
+                actions.append((random.choice(board.legal_moves(board.side_to_move)), None))
+            else:
+                actions.append(self._backup(tree, values))
+        return actions
+
+    def step(self, losses, greedy=True, learn=True):
+        # plays one ply in every game and returns the trajectories of the games that finished.
+        # finished games are restarted from the initial position.
+        finished = []
+        actions = self._search(greedy)
+        for idx, (action, score) in enumerate(actions):
+            board = self.boards[idx]
+            trajectory = self.trajectories[idx]
+            trajectory['states'].append(board.get_state(board.side_to_move))
+            mover = board.side_to_move
+            trajectory['plies'].append((board.hash, MoveUtils.encode(action), mover))
+            trajectory['positions'].append(board.to_bytes())
+            board, reward, done = board.apply_move(action)
+            if not done:
+                reward, done = self.agent.adjudicate(score, mover, trajectory['adjudication'])
+            trajectory['next_states'].append(board.get_state(1 - board.side_to_move))
+            trajectory['rewards'].append(reward)
+
+            if learn:
+                self.agent.train(trajectory['states'], trajectory['rewards'], trajectory['next_states'],
+                                 trajectory['eligibilities'], done, losses)
+
+            if done:
+                trajectory['positions'].append(board.to_bytes())
+                if reward != 0:
+                    trajectory['winner'] = mover if reward == 1 else 1 - mover
+                finished.append(trajectory)
+                self.boards[idx] = Board()
+                self.trajectories[idx] = self._new_trajectory()
+            else:
+                self.boards[idx] = board
+        return finished
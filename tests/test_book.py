@@ -0,0 +1,61 @@
+from book import *
+import pytest
+
+
+def opening_move(board, text):
+    return MoveUtils.encode(MoveUtils.from_uci(board, text))
+
+
+def test_write_and_lookup(tmp_path):
+    board = Board()
+    e4, d4 = opening_move(board, 'e2e4'), opening_move(board, 'd2d4')
+    builder = BookBuilder()
+    builder.add_game([(board.hash, e4, 0)], 0)
+    builder.add_game([(board.hash, e4, 0)], None)
+    builder.add_game([(board.hash, d4, 0)], 1)
+    path = str(tmp_path / 'book.bin')
+    builder.write(path)
+
+    book = OpeningBook(path)
+    assert sorted(book.lookup(board.hash)) == sorted([(e4, 2, 0.5), (d4, 1, -1.0)])
+    assert book.lookup(board.hash + 1) == []
+    book.close()
+
+
+def test_merge_adds_visits(tmp_path):
+    board = Board()
+    e4 = opening_move(board, 'e2e4')
+    paths = []
+    for idx, winner in enumerate([0, 1]):
+        builder = BookBuilder()
+        builder.add_game([(board.hash, e4, 0)], winner)
+        paths.append(str(tmp_path / f'part{idx}.bin'))
+        builder.write(paths[-1])
+    merge(str(tmp_path / 'merged.bin'), paths)
+    book = OpeningBook(str(tmp_path / 'merged.bin'))
+    assert book.lookup(board.hash) == [(e4, 2, 0.0)]
+    book.close()
+
+
+def test_sample_skips_rare_and_lost_moves(tmp_path):
+    board = Board()
+    e4, d4, c4 = opening_move(board, 'e2e4'), opening_move(board, 'd2d4'), opening_move(board, 'c2c4')
+    builder = BookBuilder()
+    builder.add(board.hash, e4, 5, 2.0)
+    builder.add(board.hash, d4, 5, -5.0)
+    builder.add(board.hash, c4, 1, 1.0)
+    path = str(tmp_path / 'book.bin')
+    builder.write(path)
+    book = OpeningBook(path)
+    for _ in range(20):
+        assert MoveUtils.encode(book.sample(board, play_rate=1.0)) == e4
+    assert book.sample(board, play_rate=0.0) is None
+    assert book.sample(Board('4k3/8/8/8/8/8/8/4K3 w - - 0 1'), play_rate=1.0) is None
+    book.close()
+
+
+def test_rejects_other_files(tmp_path):
+    path = tmp_path / 'book.bin'
+    path.write_bytes(HEADER.pack(b'NOPE', VERSION, 0))
+    with pytest.raises(ValueError):
+        OpeningBook(str(path))
@@ -0,0 +1,55 @@
+from checkpoint import *
+from types import SimpleNamespace
+import torch.nn as nn
+import torch.optim as optim
+
+
+def make_agent():
+    model = nn.Linear(4, 1)
+    return SimpleNamespace(model=model, optimizer=optim.AdamW(model.parameters()), episodes=0, epsilon=0.5)
+
+
+def test_writes_keeps_and_resumes(tmp_path):
+    folder = str(tmp_path)
+    agent = make_agent()
+    writer = CheckpointWriter(folder, keep=2)
+    for index in range(1, 4):
+        agent.episodes = 100 * index
+        writer.submit(agent, [0.1 * index], index)
+    writer.close()
+
+    assert [os.path.basename(path) for path in list_checkpoints(folder)] == ['checkpoint2.pt', 'checkpoint3.pt']
+    state = load_latest(folder)
+    assert state['episodes'] == 300
+    assert state['losses'] == [0.1 * 3]
+    for key, value in agent.model.state_dict().items():
+        assert torch.equal(state['model'][key], value)
+    assert os.path.exists(os.path.join(folder, 'model3.pth'))
+
+
+def test_snapshot_is_not_changed_by_training(tmp_path):
+    agent = make_agent()
+    state = CheckpointWriter.snapshot(agent, [])
+    with torch.no_grad():
+        agent.model.weight.add_(1.0)
+    assert not torch.equal(state['model']['weight'], agent.model.weight)
+
+
+def test_analysis_runs_before_the_save_and_never_blocks_it(tmp_path):
+    folder = str(tmp_path)
+    seen = []
+
+    def analyze(state, index, analyze_folder):
+        seen.append((index, os.path.exists(os.path.join(analyze_folder, f'model{index}.pth'))))
+        raise RuntimeError('match failed')
+
+    writer = CheckpointWriter(folder, analyze=analyze)
+    writer.submit(make_agent(), [], 1)
+    writer.queue.join()
+    writer.close()
+    assert seen == [(1, False)]
+    assert len(list_checkpoints(folder)) == 1
+
+
+def test_nothing_to_resume(tmp_path):
+    assert load_latest(str(tmp_path / 'missing')) is None
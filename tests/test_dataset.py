@@ -0,0 +1,56 @@
+from dataset import *
+from dataset import _epd_samples, _pgn_samples
+import pytest
+
+
+@pytest.fixture
+def shards(tmp_path):
+    # 250 rows over shards of 100, row i has every feature i % 64 and label i.
+    folder = str(tmp_path / 'shards')
+    writer = ShardWriter(folder, shard_rows=100)
+    for start in range(0, 250, 50):
+        rows = np.arange(start, start + 50)
+        writer.add(np.repeat((rows % 64).astype(np.float32)[:, None], STATE_SIZE, axis=1), rows.astype(np.float32))
+    index = writer.close()
+    assert index['rows'] == 250
+    assert [shard['rows'] for shard in index['shards']] == [100, 100, 50]
+    return folder
+
+
+def test_runs_stay_within_shards(shards):
+    dataset = ShardDataset(shards, run_rows=32)
+    assert dataset.runs[:4] == [(0, 0, 32), (0, 32, 64), (0, 64, 96), (0, 96, 100)]
+    assert len(dataset) == 4 + 4 + 2
+    features, labels = dataset[[3, 4]]
+    assert features.dtype == torch.float32 and features.shape == (36, STATE_SIZE)
+    assert labels.shape == (36, 1)
+    assert labels[:, 0].tolist() == list(range(96, 132))
+    assert torch.equal(features[:, 0], labels[:, 0] % 64)
+
+
+def test_sampler_delivers_every_row_once_per_epoch(shards):
+    dataset = ShardDataset(shards, run_rows=16)
+    sampler = RunBatchSampler(dataset, batch_size=64, run_rows=16)
+    loader = DataLoader(dataset, sampler=sampler, batch_size=None)
+    for _ in range(2):
+        seen = []
+        for features, labels in loader:
+            assert len(labels) <= 64
+            seen += labels[:, 0].tolist()
+        assert sorted(seen) == list(range(250))
+    assert len(list(sampler)) == len(sampler)
+
+
+def test_epd_labels():
+    samples = _epd_samples('rnbqkbnr/pppppppp/8/8/4P3/8/PPPP1PPP/RNBQKBNR b KQkq - c9 "1-0";')
+    assert len(samples) == 1 and samples[0][1] == -1.0
+    assert _epd_samples('4k3/8/8/8/8/8/8/4K2Q w - - ce 0;')[0][1] == 0.0
+    assert _epd_samples('4k3/8/8/8/8/8/8/4K2Q w - -') == []
+
+
+def test_pgn_samples_replay_the_game():
+    text = '[Result "0-1"]\n\n1. e4 {best} e5 2. Nf3 (2. f4) Nc6 3. Bc4 Nf6 4. O-O 0-1\n'
+    samples = _pgn_samples(text)
+    assert len(samples) == 7
+    assert [label for _, label in samples] == [-1.0, 1.0] * 3 + [-1.0]
+    assert _pgn_samples('[Result "*"]\n\n1. e4 *\n') == []
@@ -0,0 +1,37 @@
+from endgame import *
+import pytest
+
+
+@pytest.fixture(scope='module')
+def tables(tmp_path_factory):
+    folder = str(tmp_path_factory.mktemp('endgames'))
+    generate(folder)
+    return load_tables(folder)
+
+
+@pytest.mark.parametrize('fen, result', [
+    # kqk: mate follows for white, unless black takes the hanging queen.
+    ('k7/8/8/8/8/8/8/3QK3 w - - 0 1', 1),
+    ('k7/8/8/8/8/8/8/3QK3 b - - 0 1', -1),
+    ('k7/1Q6/8/8/8/8/8/7K b - - 0 1', 0),
+    # krk, also with the colors swapped.
+    ('8/8/8/4k3/8/8/8/R6K w - - 0 1', 1),
+    ('r6k/8/8/8/4K3/8/8/8 b - - 0 1', 1),
+    ('r6k/8/8/8/4K3/8/8/8 w - - 0 1', -1),
+    # kpk: the pawn queens, or black takes it.
+    ('6k1/3KP3/8/8/8/8/8/8 w - - 0 1', 1),
+    ('6k1/3KP3/8/8/8/8/8/8 b - - 0 1', -1),
+    ('8/8/8/8/3kP3/8/8/K7 b - - 0 1', 0),
+])
+def test_probe(tables, fen, result):
+    assert tables.probe(Board(fen)) == result
+
+
+def test_positions_outside_the_tables(tables):
+    assert tables.probe(Board()) is None
+    assert tables.probe(Board('k7/8/8/8/8/8/8/4K3 w - - 0 1')) == 0
+    assert tables.probe(Board('k7/8/8/8/8/8/8/3NK3 w - - 0 1')) == 0
+
+
+def test_missing_tables(tmp_path):
+    assert load_tables(str(tmp_path)) is None
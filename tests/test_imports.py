@@ -0,0 +1,21 @@
+import os
+import pytest
+import subprocess
+import sys
+
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+@pytest.mark.parametrize('module', ['chess', 'endgame', 'book', 'search'])
+def test_core_modules_do_not_import_torch(module):
+    # checked in a fresh interpreter, this one has torch loaded by the other tests.
+    code = f"import sys, {module}; print('torch' in sys.modules, 'numpy' in sys.modules)"
+    output = subprocess.run([sys.executable, '-c', code], cwd=ROOT, capture_output=True, text=True, check=True).stdout
+    assert output.split() == ['False', 'False']
+
+
+def test_state_imports_torch_on_demand():
+    code = "import chess; state = chess.Board().get_state(0); print(type(state).__name__, state.dtype, len(state))"
+    output = subprocess.run([sys.executable, '-c', code], cwd=ROOT, capture_output=True, text=True, check=True).stdout
+    assert output.split() == ['Tensor', 'torch.float32', '333']
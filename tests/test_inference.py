@@ -0,0 +1,41 @@
+from inference import *
+import pytest
+
+
+@pytest.fixture(scope='module')
+def model():
+    torch.manual_seed(0)
+    model = DNN()
+    model.eval()
+    return model
+
+
+@pytest.mark.parametrize('backend', ['fp32', 'numpy', 'int8'])
+def test_exports_follow_the_model_on_both_layouts(model, backend):
+    frozen = export(model, backend)
+    states = validation_states()
+    large = states.repeat(INFERENCE_HYPERPARAMS['fused_batch'] // len(states) + 1, 1)
+    for batch in [states[:1], states, large]:
+        assert max_error(model, frozen, batch) <= INFERENCE_TOLERANCE[backend]
+
+
+def test_single_state(model):
+    state = validation_states()[0]
+    with torch.no_grad():
+        expected = float(model(state))
+    assert abs(float(export(model, 'fp32')(state)) - expected) <= INFERENCE_TOLERANCE['fp32']
+
+
+def test_refuses_an_inaccurate_export():
+    model = DNN()
+    with torch.no_grad():
+        # one outlier weight sets the int8 scale of its whole row.
+        model.overall.weight[0][5] = 300
+    with pytest.raises(ValueError):
+        export(model, 'int8')
+    export(model, 'int8', validate=False)
+
+
+def test_unknown_backend(model):
+    with pytest.raises(ValueError):
+        export(model, 'fp16')
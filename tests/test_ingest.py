@@ -0,0 +1,65 @@
+from ingest import *
+from types import SimpleNamespace
+import pytest
+
+
+def make_trajectory(moves, winner):
+    board = Board()
+    trajectory = {'plies': [], 'positions': [], 'rewards': [], 'winner': winner}
+    for text in moves:
+        move = MoveUtils.from_uci(board, text)
+        trajectory['plies'].append((board.hash, MoveUtils.encode(move), board.side_to_move))
+        trajectory['positions'].append(board.to_bytes())
+        board, reward, _ = board.apply_move(move)
+        trajectory['rewards'].append(reward)
+    trajectory['positions'].append(board.to_bytes())
+    return trajectory
+
+
+@pytest.fixture(scope='module')
+def trajectories():
+    return [make_trajectory(['e2e4', 'e7e5', 'g1f3'], None), make_trajectory(['d2d4'], 0)]
+
+
+def test_pack_round_trip(trajectories):
+    unpacked = unpack_trajectories(pack_trajectories(trajectories))
+    assert len(unpacked) == 2
+    for trajectory, restored in zip(trajectories, unpacked):
+        assert restored['positions'] == trajectory['positions']
+        assert restored['moves'] == [code for _, code, _ in trajectory['plies']]
+        assert restored['rewards'] == trajectory['rewards']
+        assert restored['winner'] == trajectory['winner']
+
+
+def test_corrupt_batches_are_refused(trajectories):
+    data = pack_trajectories(trajectories)
+    with pytest.raises(ValueError):
+        unpack_trajectories(BATCH.pack(1, Board.packed_size + 1) + data[BATCH.size:])
+    with pytest.raises(struct.error):
+        unpack_trajectories(data[:len(data) // 2])
+
+
+def test_server_drops_corrupt_actors_and_keeps_serving(tmp_path, trajectories):
+    address = f'unix:{tmp_path}/ingest.sock'
+    server = IngestServer(address, queue_size=8, report_seconds=0)
+    try:
+        for payload in [b'not zlib', zlib.compress(b'\x01'), zlib.compress(BATCH.pack(1, 1))]:
+            client = IngestClient(address)
+            with pytest.raises(ConnectionError):
+                client._request(PUSH, payload)
+            client.close()
+
+        client = IngestClient(address)
+        assert client.pull() is None
+        model = torch.nn.Linear(2, 1)
+        assert server.publish(SimpleNamespace(model=model, epsilon=0.25)) == 1
+        assert client.push(trajectories) == 1
+        assert server.get()['moves'] == [code for _, code, _ in trajectories[0]['plies']]
+        assert server.get()['winner'] == 0
+        weights = client.pull()
+        assert weights['epsilon'] == 0.25
+        assert torch.equal(weights['model']['weight'], model.weight)
+        assert client.pull() is None
+        client.close()
+    finally:
+        server.close()
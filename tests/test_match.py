@@ -0,0 +1,57 @@
+from match import *
+from match import _opening
+import pytest
+
+
+SPRT = (0, 50)
+
+
+def test_counts_and_elo():
+    report = summarize([1.0, 0.5, 0.5, 0.0, 1.0, 1.0], sprt=None)
+    assert (report['games'], report['wins'], report['draws'], report['losses']) == (6, 3, 2, 1)
+    assert report['score'] == pytest.approx(4 / 6)
+    assert report['elo'] > 0
+    assert report['elo_ci95'][0] < report['elo'] < report['elo_ci95'][1]
+    assert 'sprt' not in report
+    assert summarize([0.5, 1.0, 0.0], sprt=None)['elo'] == pytest.approx(0.0)
+
+
+@pytest.mark.parametrize('result, expected', [(1.0, 'H1'), (0.5, 'H0'), (0.0, 'H0')])
+def test_sprt_stops_one_sided_matches(result, expected):
+    # every game ends the same way, so the results have no variance.
+    report = summarize([result] * MATCH_HYPERPARAMS['min_games'], sprt=SPRT)
+    assert report['sprt']['result'] == expected
+
+
+def test_sprt_keeps_playing_when_undecided():
+    report = summarize([1.0, 0.0, 0.5, 0.5], sprt=SPRT)
+    lower, upper = report['sprt']['bounds']
+    assert lower < report['sprt']['llr'] < upper
+    assert report['sprt']['result'] is None
+
+
+def test_sprt_accepts_a_clear_winner():
+    report = summarize([1.0, 1.0, 1.0, 0.5] * 10, sprt=SPRT)
+    assert report['sprt']['result'] == 'H1'
+    assert report['sprt']['llr'] >= report['sprt']['bounds'][1]
+
+
+def test_openings_are_shared_within_a_pair_only():
+    first, second = _opening(0), _opening(0)
+    assert first.hash == second.hash
+    hashes = {_opening(pair).hash for pair in range(len(OPENINGS) * 2)}
+    assert len(hashes) == len(OPENINGS) * 2
+
+
+def test_analysis_needs_an_older_different_model(tmp_path):
+    from agent import analyze_performance
+    from model import DNN
+
+    weights = DNN().state_dict()
+    state = {'model': weights, 'episodes': 200}
+    assert analyze_performance(state, 2, str(tmp_path)) is None
+    torch.save(weights, str(tmp_path / 'model1.pth'))
+    # the newest model holds the same weights, as it does right after a resume.
+    assert analyze_performance(state, 2, str(tmp_path)) is None
+    torch.save(DNN().state_dict(), str(tmp_path / 'model2.pth'))
+    assert analyze_performance(state, 2, str(tmp_path)) is None
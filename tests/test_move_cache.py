@@ -0,0 +1,47 @@
+from chess import *
+import pytest
+
+
+@pytest.fixture
+def cache():
+    # a private cache, so no test sees positions generated by another.
+    saved = Board.move_cache
+    Board.move_cache = MoveCache(size=1024)
+    yield Board.move_cache
+    Board.move_cache = saved
+
+
+def summary(board):
+    moves = {color: sorted(MoveUtils.to_uci(move) for move in board.legal_moves(color)) for color in range(2)}
+    attacks = sorted((piece.row, piece.col, sorted((cell.row, cell.col) for cell in piece.attacks))
+                     for color in range(2) for piece in board.material[color])
+    return moves, attacks, board.lowest_attackers, board.get_features(board.side_to_move)
+
+
+@pytest.mark.parametrize('fen', [
+    'r1bqkb1r/pppp1ppp/2n2n2/4p2Q/2B1P3/8/PPPP1PPP/RNB1K1NR w KQkq - 4 4',
+    '4k3/1P6/8/8/8/8/6p1/4K2R b K - 0 1',
+    'r1bqkb1r/pppp1Qpp/2n2n2/4p3/2B1P3/8/PPPP1PPP/RNB1K1NR b KQkq - 0 4',
+])
+def test_restored_positions_match_generated_ones(cache, fen):
+    generated = Board(fen)
+    assert cache.misses == 1 and cache.hits == 0
+    restored = Board(fen)
+    assert cache.hits == 1
+    assert summary(restored) == summary(generated)
+    assert restored.is_checkmate(restored.side_to_move) == generated.is_checkmate(generated.side_to_move)
+
+
+def test_store_respects_the_byte_budget():
+    cache = MoveCache(size=16, max_bytes=1000)
+    cache.store(1, bytes(100))
+    assert cache.probe(1) == bytes(100)
+    assert cache.probe(17) is None
+    cache.store(2, bytes(2000))
+    assert cache.probe(2) is None
+    # replacing an entry frees its bytes first.
+    cache.store(17, bytes(200))
+    assert cache.probe(17) == bytes(200) and cache.probe(1) is None
+    assert cache.hit_rate() == pytest.approx(2 / 5)
+    cache.clear()
+    assert cache.probe(17) is None and cache.bytes == 0
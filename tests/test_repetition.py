@@ -0,0 +1,54 @@
+from agent import Agent, TRAIN_HYPERPARAMS
+from chess import *
+
+
+def play(board, moves):
+    done = False
+    for text in moves:
+        assert not done
+        board, _, done = board.apply_move(MoveUtils.from_uci(board, text))
+    return board, done
+
+
+def test_threefold_repetition_ends_the_game():
+    shuffle = ['g1f3', 'g8f6', 'f3g1', 'f6g8']
+    board, done = play(Board(), shuffle)
+    assert not done
+    assert board.repetitions[board.hash] == 2
+    board, done = play(board, shuffle)
+    assert done
+    assert board.is_repetition_draw()
+
+
+def test_irreversible_move_resets_repetitions():
+    board, _ = play(Board(), ['g1f3', 'g8f6', 'f3g1', 'f6g8', 'e2e4'])
+    assert board.repetitions == {board.hash: 1}
+
+
+def test_incremental_hash_matches_a_fresh_board():
+    board = Board('r3k2r/ppp2ppp/2n5/3pp3/4P3/2N2N2/PPPP1PPP/R3K2R w KQkq - 0 1')
+    for text in ['e4d5', 'c6d4', 'e1g1', 'e8c8', 'f3e5', 'd4c2']:
+        board, _, _ = board.apply_move(MoveUtils.from_uci(board, text))
+        assert board.hash == Board(board.to_fen()).hash
+
+
+def test_promotion_hash_matches_a_fresh_board():
+    board = Board('4k3/1P6/8/8/8/8/8/4K2R w K - 0 1')
+    board, _, _ = board.apply_move(MoveUtils.from_uci(board, 'b7b8q'))
+    assert board.cells[0][1].notation == 'Q'
+    assert board.hash == Board(board.to_fen()).hash
+
+
+def test_adjudication_counts_consecutive_plies():
+    counters = {'draw': 0, 'resign': 0}
+    for _ in range(TRAIN_HYPERPARAMS['draw_plies'] - 1):
+        assert Agent.adjudicate(0.0, 0, counters) == (0, False)
+    assert Agent.adjudicate(0.0, 0, counters) == (0, True)
+
+    counters = {'draw': 0, 'resign': 0}
+    score = TRAIN_HYPERPARAMS['resign_score'] + 0.01
+    for _ in range(TRAIN_HYPERPARAMS['resign_plies'] - 1):
+        Agent.adjudicate(-score, 1, counters)
+    # black played the move and white is losing, so black wins.
+    assert Agent.adjudicate(-score, 1, counters) == (1, True)
+    assert Agent.adjudicate(None, 1, counters) == (0, False)
@@ -0,0 +1,47 @@
+from search import *
+
+
+def test_store_and_probe():
+    tt = TranspositionTable(size=1024)
+    assert tt.probe(12345) is None
+    tt.store(12345, 3, LOWER, 0.25, 777)
+    assert tt.probe(12345) == (3, LOWER, 0.25, 777)
+    # another position in the same slot only reads as a miss.
+    assert tt.probe(12345 + tt.size) is None
+
+
+def test_empty_entry_is_still_stored():
+    # depth, flag, score, move and generation all zero must not look like an empty slot.
+    tt = TranspositionTable(size=1024)
+    tt.store(0, 0, EXACT, 0.0, 0)
+    assert tt.probe(0) == (0, EXACT, 0.0, 0)
+    tt.store(tt.size, 1, EXACT, 0.5, 1)
+    assert tt.probe(tt.size) == (1, EXACT, 0.5, 1)
+
+
+def test_replacement_keeps_deeper_entries_of_the_running_search():
+    tt = TranspositionTable(size=1024)
+    tt.store(7, 5, EXACT, 0.75, 1)
+    tt.store(7 + tt.size, 2, EXACT, 0.25, 2)
+    assert tt.probe(7) == (5, EXACT, 0.75, 1)
+    assert tt.probe(7 + tt.size) is None
+    # the same position is always refreshed, whatever the depth.
+    tt.store(7, 1, UPPER, 0.5, 3)
+    assert tt.probe(7) == (1, UPPER, 0.5, 3)
+
+
+def test_replacement_after_new_search():
+    tt = TranspositionTable(size=1024)
+    tt.store(7, 5, EXACT, 0.5, 1)
+    tt.new_search()
+    tt.store(7 + tt.size, 1, EXACT, 0.25, 2)
+    assert tt.probe(7) is None
+    assert tt.probe(7 + tt.size) == (1, EXACT, 0.25, 2)
+
+
+def test_clear_and_shared_table():
+    tt = TranspositionTable(size=1024, shared=True)
+    tt.store(99, 2, EXACT, 0.5, 4)
+    assert tt.probe(99) == (2, EXACT, 0.5, 4)
+    tt.clear()
+    assert tt.probe(99) is None
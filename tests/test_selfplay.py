@@ -0,0 +1,32 @@
+from agent import Agent
+from selfplay import *
+import pytest
+
+
+@pytest.fixture(scope='module')
+def agent():
+    torch.manual_seed(0)
+    return Agent()
+
+
+def test_batched_search_agrees_with_the_agent(agent):
+    env = VecSelfPlay(agent, games=2, depth=1)
+    env.boards[1] = Board('r1bqkb1r/pppp1ppp/2n2n2/4p3/2B1P3/5N2/PPPP1PPP/RNBQK2R b KQkq - 5 4')
+    actions = env._search(greedy=False)
+    assert env.leaf_evaluations == len(env.boards[0].legal_moves(0)) + len(env.boards[1].legal_moves(1))
+    for board, (move, score) in zip(env.boards, actions):
+        _, expected = agent._minimax_search_alpha_beta(board, 1, -2.0, 2.0)
+        assert score == pytest.approx(expected, abs=1e-5)
+
+
+def test_finished_games_restart(agent):
+    env = VecSelfPlay(agent, games=2, depth=1)
+    env.boards[0] = Board('6k1/5ppp/8/8/8/8/8/R5K1 w - - 0 1')
+    finished = env.step([], greedy=False, learn=False)
+    assert len(finished) == 1
+    assert finished[0]['winner'] == 0
+    assert finished[0]['rewards'] == [1]
+    assert len(finished[0]['positions']) == 2
+    assert env.boards[0].to_fen() == Board().to_fen()
+    assert env.trajectories[0]['plies'] == []
+    assert len(env.trajectories[1]['plies']) == 1
@@ -0,0 +1,34 @@
+from chess import *
+
+
+def play(board, moves):
+    for text in moves:
+        board, _, _ = board.apply_move(MoveUtils.from_uci(board, text))
+    return board
+
+
+def test_round_trip_keeps_features_hash_and_fen():
+    board = play(Board(), ['e2e4', 'e7e5', 'g1f3', 'b8c6', 'f1c4', 'g8f6'])
+    data = board.to_bytes()
+    assert len(data) == Board.packed_size
+    restored = Board.from_bytes(data)
+    assert restored.to_fen() == board.to_fen()
+    assert restored.hash == board.hash
+    for side in range(2):
+        assert restored.get_features(side) == board.get_features(side)
+    assert restored.to_bytes() == data
+
+
+def test_round_trip_keeps_captured_pieces():
+    # a captured piece still reports its features, so its slot must survive packing.
+    board = play(Board(), ['e2e4', 'd7d5', 'e4d5', 'd8d5', 'b1c3', 'd5a5'])
+    restored = Board.from_bytes(board.to_bytes())
+    for side in range(2):
+        assert restored.get_features(side) == board.get_features(side)
+    assert {MoveUtils.to_uci(move) for move in restored.legal_moves(0)} == {MoveUtils.to_uci(move) for move in board.legal_moves(0)}
+
+
+def test_fen_round_trip():
+    fen = 'r3k2r/ppp2ppp/2n5/3pp3/4P3/2N2N2/PPPP1PPP/R3K2R b Kq - 3 12'
+    assert Board(fen).to_fen() == fen
+    assert Board.from_bytes(Board(fen).to_bytes()).to_fen() == fen
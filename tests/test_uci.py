@@ -0,0 +1,75 @@
+from uci import *
+import io
+import pytest
+
+
+CASTLING_FEN = 'r3k2r/pppppppp/8/8/8/8/PPPPPPPP/R3K2R w KQkq - 0 1'
+
+
+@pytest.mark.parametrize('text, king, rook', [('e1g1', 'g1', 'f1'), ('e1c1', 'c1', 'd1')])
+def test_castling_from_uci(text, king, rook):
+    board = Board(CASTLING_FEN)
+    move = MoveUtils.from_uci(board, text)
+    assert move.special == 'c'
+    assert MoveUtils.to_uci(move) == text
+    board, _, _ = board.apply_move(move)
+    assert board[CellUtils.cell(king)].notation == 'K'
+    assert board[CellUtils.cell(rook)].notation == 'R'
+    assert board.castling[0] == [0, 0]
+    assert board.hash == Board(board.to_fen()).hash
+
+
+def test_black_castling_from_uci():
+    board = Board(CASTLING_FEN.replace(' w ', ' b '))
+    board, _, _ = board.apply_move(MoveUtils.from_uci(board, 'e8g8'))
+    assert board.to_fen().startswith('r4rk1/')
+    assert board.castling[1] == [0, 0]
+
+
+@pytest.mark.parametrize('fen, text', [
+    # no right left, pieces in the way, rook gone, king in check, crossing and landing on attacked squares.
+    ('r3k2r/pppppppp/8/8/8/8/PPPPPPPP/R3K2R w Qkq - 0 1', 'e1g1'),
+    ('r3k2r/pppppppp/8/8/8/8/PPPPPPPP/R3KB1R w KQkq - 0 1', 'e1g1'),
+    ('r3k2r/pppppppp/8/8/8/8/PPPPPPPP/RN2K2R w KQkq - 0 1', 'e1c1'),
+    ('r3k2r/pppppppp/8/8/8/8/PPPPPPPP/R3K3 w KQkq - 0 1', 'e1g1'),
+    ('r3k2r/8/8/8/4r3/8/8/R3K2R w KQkq - 0 1', 'e1g1'),
+    ('r3k2r/8/8/8/5r2/8/8/R3K2R w KQkq - 0 1', 'e1g1'),
+    ('r3k2r/8/8/8/6r1/8/8/R3K2R w KQkq - 0 1', 'e1g1'),
+    ('r3k2r/8/8/8/3r4/8/8/R3K2R w KQkq - 0 1', 'e1c1'),
+])
+def test_illegal_castling_is_refused(fen, text):
+    assert MoveUtils.from_uci(Board(fen), text) is None
+
+
+def test_castling_across_an_attacked_b_file_is_allowed():
+    # only the squares the king crosses must be safe, the rook may pass an attacked square.
+    board = Board('r3k2r/8/8/8/1r6/8/8/R3K2R w KQkq - 0 1')
+    assert MoveUtils.from_uci(board, 'e1c1') is not None
+
+
+def test_castling_from_san():
+    board = Board(CASTLING_FEN)
+    assert MoveUtils.to_uci(MoveUtils.from_san(board, 'O-O')) == 'e1g1'
+    assert MoveUtils.to_uci(MoveUtils.from_san(board, 'O-O-O')) == 'e1c1'
+    assert MoveUtils.from_san(Board(), 'O-O') is None
+
+
+def test_position_command():
+    out = io.StringIO()
+    engine = UCIEngine(None, out)
+    engine.handle('position startpos moves e2e4 e7e5 g1f3 b8c6 f1c4 g8f6 e1g1')
+    assert engine.board.to_fen().startswith('r1bqkb1r/pppp1ppp/2n2n2/4p3/2B1P3/5N2/PPPP1PPP/RNBQ1RK1 b kq - ')
+    engine.handle(f'position fen {CASTLING_FEN} moves e1g1 e8g8 e2e4')
+    assert engine.board.to_fen().startswith('r4rk1/')
+    engine.handle('position startpos moves e2e4 e1g1')
+    assert 'unsupported move e1g1' in out.getvalue()
+    assert engine.board.side_to_move == 1
+
+
+def test_handshake():
+    out = io.StringIO()
+    engine = UCIEngine(None, out)
+    assert engine.handle('uci')
+    assert engine.handle('isready')
+    assert not engine.handle('quit')
+    assert out.getvalue().splitlines()[-2:] == ['uciok', 'readyok']
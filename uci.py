@@ -0,0 +1,189 @@
+from agent import Agent
+from chess import *
+from search import *
+import argparse
+import math
+import sys
+import threading
+import torch
+
+
+UCI_HYPERPARAMS = {
+    'max_depth': 64,
+    'moves_to_go': 30,      # assumed remaining moves when the clock gives no movestogo
+}
+
+
+def _centipawns(score, side):
+    # DNN outputs tanh(pawns / 10) from white's point of view.
+    score = max(-0.999, min(0.999, score)) * (1 - 2*side)
+    return int(math.atanh(score) * 1000)
+
+
+class UCIEngine:
+    def __init__(self, agent, out=sys.stdout):
+        self.agent = agent
+        self.out = out
+        self.lock = threading.Lock()
+        self.board = Board()
+        self.thread = None
+        self.stop_event = threading.Event()
+        self.release = threading.Event()    # lets an infinite or ponder search print bestmove
+        self.timer = None
+        self.pondering = False
+        self.movetime = None
+
+    def send(self, line):
+        with self.lock:
+            self.out.write(line + '\n')
+            self.out.flush()
+
+    def _info(self, depth, score, nodes, seconds, pv):
+        nps = int(nodes / seconds) if seconds > 0 else 0
+        self.send(f'info depth {depth} score cp {_centipawns(score, self.board.side_to_move)} nodes {nodes} '
+                  f'nps {nps} time {int(seconds * 1000)} pv {" ".join(MoveUtils.to_uci(move) for move in pv)}')
+
+    def _start_timer(self, seconds):
+        # the timer is bound to the stop event of the running search, one left over from an
+        # earlier search can only stop that search.
+        if seconds is not None:
+            self.timer = threading.Timer(seconds, self.stop_event.set)
+            self.timer.daemon = True
+            self.timer.start()
+
+    def _cancel_timer(self):
+        if self.timer is not None:
+            self.timer.cancel()
+            self.timer = None
+
+    def _search(self, board, depth, wait, stop_event, release):
+        # a gui waits for bestmove after every go, so one is sent even if the search fails.
+        move, ponder = None, ''
+        try:
+            move, _ = iterative_deepening(self.agent, board, depth, stop_event, self._info)
+            if wait:
+                # go infinite and go ponder must not answer before stop or ponderhit.
+                release.wait()
+            pv = principal_variation(self.agent, board, 2)
+            ponder = f' ponder {MoveUtils.to_uci(pv[1])}' if len(pv) > 1 and pv[0] == move else ''
+        except Exception as error:
+            self.send(f'info string search failed: {error!r}')
+            if move is None:
+                legals = board.legal_moves(board.side_to_move)
+                move = legals[0] if len(legals) > 0 else None
+        self.send(f'bestmove {"0000" if move is None else MoveUtils.to_uci(move)}{ponder}')
+
+    def _position(self, tokens):
+        if tokens[0] == 'startpos':
+            board = Board()
+            tokens = tokens[1:]
+        else:
+            board = Board(' '.join(tokens[1:7]))
+            tokens = tokens[7:]
+        if len(tokens) > 0 and tokens[0] == 'moves':
+            for text in tokens[1:]:
+                move = MoveUtils.from_uci(board, text)
+                if move is None:
+                    self.send(f'info string unsupported move {text}, position set before it')
+                    break
+                board, _, _ = board.apply_move(move)
+        self.board = board
+
+    def _go(self, tokens):
+        args = {}
+        for idx, token in enumerate(tokens):
+            if token in ['movetime', 'depth', 'wtime', 'btime', 'winc', 'binc', 'movestogo']:
+                args[token] = int(tokens[idx + 1])
+        infinite = 'infinite' in tokens
+        self.pondering = 'ponder' in tokens
+        depth = args.get('depth', UCI_HYPERPARAMS['max_depth'])
+
+        self.movetime = None
+        if 'movetime' in args:
+            self.movetime = args['movetime'] / 1000
+        elif 'wtime' in args or 'btime' in args:
+            color = 'w' if self.board.side_to_move == 0 else 'b'
+            remaining = args.get(f'{color}time', 0) / 1000
+            increment = args.get(f'{color}inc', 0) / 1000
+            self.movetime = remaining / args.get('movestogo', UCI_HYPERPARAMS['moves_to_go']) + increment / 2
+
+        # every search gets its own events, two searches never share a stop event.
+        self._stop()
+        self.stop_event = threading.Event()
+        self.release = threading.Event()
+        if not infinite and not self.pondering:
+            self.release.set()
+            self._start_timer(self.movetime)
+        self.thread = threading.Thread(target=self._search, daemon=True,
+                                       args=(self.board, depth, infinite or self.pondering, self.stop_event, self.release))
+        self.thread.start()
+
+    def _stop(self):
+        self._cancel_timer()
+        if self.thread is not None:
+            self.stop_event.set()
+            self.release.set()
+            self.thread.join()
+            self.thread = None
+
+    def _ponderhit(self):
+        # the expected move was played, the ponder search continues on our own clock. the timer
+        # is running before the search is released, so _stop can always cancel it.
+        self.pondering = False
+        self._start_timer(self.movetime)
+        self.release.set()
+
+    def handle(self, line):
+        # processes one command and returns False once the engine should exit.
+        tokens = line.split()
+        if len(tokens) == 0:
+            return True
+        match tokens[0]:
+            case 'uci':
+                self.send('id name deep-carlsen')
+                self.send('id author deep-carlsen')
+                self.send('option name Ponder type check default false')
+                self.send('uciok')
+            case 'isready':
+                self.send('readyok')
+            case 'ucinewgame':
+                self._stop()
+                self.board = Board()
+                self.agent.new_game()
+            case 'position':
+                self._stop()
+                self._position(tokens[1:])
+            case 'go':
+                self._stop()
+                self._go(tokens[1:])
+            case 'stop':
+                self._stop()
+            case 'ponderhit':
+                self._ponderhit()
+            case 'quit':
+                self._stop()
+                return False
+        return True
+
+    def loop(self, source=sys.stdin):
+        for line in source:
+            if not self.handle(line):
+                break
+
+
+def main():
+    parser = argparse.ArgumentParser(description='deep-carlsen UCI engine')
+    parser.add_argument('--model', help='weights saved by DNN.save or the checkpoint writer')
+    parser.add_argument('--backend', default='fp32', help='inference backend for leaf evaluation')
+    args = parser.parse_args()
+
+    agent = Agent()
+    if args.model is not None:
+        agent.model.load_state_dict(torch.load(args.model, map_location='cpu'))
+    agent.freeze(args.backend)
+    agent.tt = TranspositionTable()
+    UCIEngine(agent).loop()
+
+
+if __name__ == '__main__':
+    main()